@@ -24,13 +24,144 @@ Implements the Distutils 'build_manpages' command.
 
 __revision__ = "$Id$"		# TODO: what should i do with this?
 
+import sys			# for sys.stderr
 import os.path			# for os.path.isfile()
+import glob			# for multi page template globs
+import types			# to spot code objects
+import json			# for the build manifest
+import hashlib			# to detect changed inputs
+import multiprocessing		# to render pages in parallel
 import distutils.core		# from distutils.core import Command
 import distutils.command.build	# from distutils.command.build import build
 import distutils.errors		# from distutils.errors import DistutilsOptionError
 from jhelp import manhelp	# to generate man pages
 _ = lambda x: x			# add fake gettext function until i fix up i18n
 
+# the namespace is acquired once, and is inherited by the forked workers. it
+# can't be sent to them, since the manhelp formatting functions don't pickle.
+_NAMESPACE = {}
+
+# the manifest records what each output was built from, in every directory.
+MANIFEST = '.build_manpages.json'
+
+
+def digest(data):
+	"""returns the sha1 hex digest of a string."""
+	return hashlib.sha1(data).hexdigest()
+
+
+def file_digest(filename):
+	"""returns the sha1 hex digest of a file, or None if it's missing."""
+	try:
+		f = open(filename, 'rb')
+	except IOError:
+		return None
+	try:
+		return digest(f.read())
+	finally:
+		f.close()
+
+
+def namespace_digest(namespace):
+	"""returns a digest of a namespace that is stable across runs. the
+	functions in it are identified by their name, their byte code, the
+	code of any nested functions, their defaults and the values that they
+	close over, which are all digested the same way, recursively."""
+	memo = {}		# recursive closures refer to themselves
+	def stable(x):
+		if type(x) is dict:
+			return '{%s}' % ', '.join(['%s: %s' % (stable(k), stable(v))
+				for (k, v) in sorted(x.items())])
+		elif type(x) in [list, tuple]:
+			return '[%s]' % ', '.join([stable(y) for y in x])
+		elif type(x) is types.CodeType:
+			return digest('%s:%s:%s' % (x.co_code,
+				stable(x.co_names), stable(x.co_consts)))
+		elif callable(x):
+			x = getattr(x, 'im_func', x)	# methods
+			code = getattr(x, 'func_code', None)
+			if code is not None and id(x) in memo:
+				code = memo[id(x)]
+			elif code is not None:
+				memo[id(x)] = 'recursive'
+				cells = []
+				for cell in x.func_closure or ():
+					try: cells.append(cell.cell_contents)
+					except ValueError: cells.append(None)
+				code = digest('%s:%s:%s' % (stable(code),
+					stable(x.func_defaults), stable(cells)))
+				memo[id(x)] = code
+			return '%s.%s:%s' % (getattr(x, '__module__', None),
+				getattr(x, '__name__', None), code)
+		return repr(x)
+	return digest(stable(namespace))
+
+
+def load_manifest(dirname):
+	"""returns the manifest dict of the outputs in dirname."""
+	try:
+		f = open(os.path.join(dirname, MANIFEST), 'r')
+	except IOError:
+		return {}
+	try:
+		try:
+			return json.load(f)
+		except ValueError:
+			return {}	# corrupt, so rebuild everything
+	finally:
+		f.close()
+
+
+def save_manifest(dirname, manifest):
+	"""writes out the manifest dict of the outputs in dirname."""
+	f = open(os.path.join(dirname, MANIFEST), 'w')
+	try:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	finally:
+		f.close()
+
+
+def render_page(args):
+	"""render one page template into its compressed output, and optionally
+	the ps output in psdir, unless the manifest entry shows the template,
+	namespace and compression are unchanged and the outputs are intact. this runs
+	inside of the worker processes, and returns a tuple of the template,
+	the gzoutput, the success, the new manifest entry and if it rebuilt."""
+	(template, gzoutput, psdir, force, entry, nsdigest, compression) = args
+	if entry is None: entry = {}
+	same = not force and entry.get('template') == file_digest(template) \
+	and entry.get('namespace') == nsdigest \
+	and entry.get('compression') == list(compression)
+	gzok = same and entry.get('gzip') == file_digest(gzoutput)
+	psok = psdir is None
+	if not psok and same and entry.get('ps'):
+		psok = os.path.isfile(os.path.join(psdir,
+			'%s.%d.ps' % manhelp.guess(template)))
+	if gzok and psok:
+		entry['source'] = os.path.abspath(template)
+		return (template, gzoutput, True, entry, False)
+
+	obj = manhelp.manhelp(template, _NAMESPACE, stream=True)
+	result = True
+	if not gzok: result = obj.tocompressedfile(gzoutput, *compression)
+	if not psok:
+		if not obj.topsfile(psdir):
+			print >> sys.stderr, _('groff failed for: %s: %s') % \
+			(template, obj.grofferror)
+			result = False
+	whatis = obj.whatis
+	if whatis is None: whatis = entry.get('whatis', [])
+	entry = {
+		'whatis': whatis,
+		'source': os.path.abspath(template),
+		'template': file_digest(template),
+		'namespace': nsdigest,
+		'gzip': file_digest(gzoutput),
+		'compression': list(compression),
+		'ps': psdir is not None or (same and entry.get('ps', False)),
+	}
+	return (template, gzoutput, result, entry, True)
+
 
 class build_manpages(distutils.core.Command):
 	# FIXME: use the dry-run option...
@@ -38,51 +169,192 @@ class build_manpages(distutils.core.Command):
 	user_options = [
 		('psoutput=', 'p', 'specifies the ps output file location'),
 		('gzoutput=', 'o', 'specifies the gzip output file location'),
+		('compression=', 'c', 'specifies gzip, bzip2, xz or zstd output'),
+		('level=', 'l', 'specifies the compression level to use'),
 		('template=', 't', 'specifies which man page template file'),
 		('namespace=', 'n', 'specifies the manhelp namespace function'),
 		('diroutput=', 'd', 'specifies the base directory for output'),
+		('templates=', 'T', 'specifies a directory or glob of templates'),
+		('jobs=', 'j', 'specifies the number of parallel processes'),
+		('force', 'f', 'rebuild pages even if nothing has changed'),
 	]
+	boolean_options = ['force']
 
 
 	def initialize_options(self):
 		self.psoutput = None
 		self.gzoutput = None
+		self.compression = None
+		self.level = None
 		self.template = None
 		self.namespace = {}
 		self.diroutput = None
+		self.templates = None
+		self.jobs = None
+		self.force = None
 
 
 	def finalize_options(self):
 		# do some validation
-		if type(self.gzoutput) is not str:
+		if self.templates is not None:
+			# pattern: <name>.<section#>.template
+			pattern = self.templates
+			if os.path.isdir(pattern):
+				pattern = os.path.join(pattern, '*.[1-9].template')
+			self.templates = sorted(glob.glob(pattern))
+			if len(self.templates) == 0:
+				raise distutils.errors.DistutilsOptionError(
+				_('the `templates\' option matched no files.')
+				)
+
+			if self.jobs is not None:
+				try:
+					self.jobs = int(self.jobs)
+				except ValueError:
+					self.jobs = 0
+				if self.jobs < 1:
+					raise distutils.errors.DistutilsOptionError(
+					_('the `jobs\' option must be a positive integer.')
+					)
+
+		elif type(self.gzoutput) is not str:
 			raise distutils.errors.DistutilsOptionError(
 			_('the `gzoutput\' option is required.')
 			)
 
-		if not(type(self.template) is str) or \
+		elif not(type(self.template) is str) or \
 		not(os.path.isfile(self.template)):
 			raise distutils.errors.DistutilsOptionError(
 			_('the `template\' option requires an existing file.')
 			)
 
+		if self.compression is None: self.compression = 'gzip'
+		if self.compression not in manhelp.COMPRESSION:
+			raise distutils.errors.DistutilsOptionError(
+			_('the `compression\' option must be one of: %s.') %
+			', '.join(sorted(manhelp.COMPRESSION.keys()))
+			)
+		try:
+			self.level = int(self.level or 9)
+		except ValueError:
+			self.level = 0
+		maxlevel = 9
+		if self.compression == 'zstd': maxlevel = 19
+		if not 1 <= self.level <= maxlevel:
+			raise distutils.errors.DistutilsOptionError(
+			_('the `level\' option must be an integer from 1 to %d.') %
+			maxlevel
+			)
+
 		# process self.namespace
 		self.namespace = manhelp.acquire_namespace(self.namespace, \
 							verbose=self.verbose)
 
 
 	def run(self):
+		global _NAMESPACE
 		if self.verbose: print 'diroutput is: %s' % self.diroutput
 		if self.verbose: print 'namespace is: %s' % self.namespace
-		if self.verbose: print 'template file is: %s' % self.template
-		if self.verbose: print 'gzoutput file is: %s' % self.gzoutput
-		if self.verbose and type(self.psoutput) is str:
-			print 'psoutput file is: %s' % self.psoutput
+		ps = type(self.psoutput) is str
+		if self.templates is None:
+			if self.verbose: print 'template file is: %s' % self.template
+			if self.verbose: print 'gzoutput file is: %s' % self.gzoutput
+			if self.verbose and ps:
+				print 'psoutput file is: %s' % self.psoutput
+			pages = [(self.template, self.gzoutput)]
 
-		obj = manhelp.manhelp(self.template, self.namespace)
-		obj.togzipfile(self.gzoutput)
+		else:
+			if self.verbose:
+				print 'templates are: %s' % ', '.join(self.templates)
+			pages = []
+			for x in self.templates:
+				guessed = manhelp.guess(x)
+				if guessed is None:
+					raise distutils.errors.DistutilsOptionError(
+					_('unable to guess the name of: %s') % x
+					)
+				dirname = self.diroutput
+				if dirname is None: dirname = os.path.dirname(x)
+				pages.append((x, os.path.join(dirname,
+					'%s.%d' % guessed +
+					manhelp.COMPRESSION[self.compression])))
 
-		if type(self.psoutput) is str:
-			obj.topsfile(self.diroutput)
+		# look up the previous build of each page in the manifests
+		manifests = {}
+		for (x, gzoutput) in pages:
+			dirname = os.path.dirname(os.path.abspath(gzoutput))
+			if dirname not in manifests:
+				manifests[dirname] = load_manifest(dirname)
+
+		nsdigest = namespace_digest(self.namespace)
+		jobs = []
+		for (x, gzoutput) in pages:
+			psdir = None
+			if ps:
+				psdir = self.diroutput
+				if psdir is None: psdir = os.path.dirname(x)
+			gzoutput = os.path.abspath(gzoutput)
+			entry = manifests[os.path.dirname(gzoutput)].get(
+				os.path.basename(gzoutput))
+			jobs.append((x, gzoutput, psdir, self.force, entry,
+				nsdigest, (self.compression, self.level)))
+
+		_NAMESPACE = self.namespace	# before the workers fork
+		if len(jobs) == 1:
+			results = map(render_page, jobs)
+		else:
+			pool = multiprocessing.Pool(self.jobs)	# None: cpu count
+			try:
+				results = pool.map(render_page, jobs)
+			finally:
+				pool.close()
+				pool.join()
+
+		rebuilt = []
+		skipped = []
+		failed = []
+		whatis = dict([(x, []) for x in manifests.keys()])
+		for (x, gzoutput, result, entry, built) in results:
+			if not result: failed.append(x)
+			elif built: rebuilt.append(x)
+			else: skipped.append(x)
+			if result:
+				manifests[os.path.dirname(gzoutput)][
+					os.path.basename(gzoutput)] = entry
+			if result and built:
+				whatis[os.path.dirname(gzoutput)].extend(
+					entry['whatis'])
+
+		# forget the pages whose output or template is gone, such as if
+		# it was renamed, and prune them from the index. pages that were
+		# only left out of this build are kept. only the index lines of
+		# the rebuilt pages are added.
+		current = set([os.path.abspath(x[1]) for x in pages])
+		for (dirname, manifest) in manifests.items():
+			for name in manifest.keys():
+				path = os.path.join(dirname, name)
+				if path in current: continue
+				source = manifest[name].get('source')
+				if not os.path.isfile(path) or (source is not None
+				and not os.path.isfile(source)):
+					del manifest[name]
+			save_manifest(dirname, manifest)
+			index = os.path.join(dirname, manhelp.INDEX)
+			if whatis[dirname] or os.path.isfile(index):
+				keep = [tuple(x[:2]) for entry in manifest.values()
+					for x in entry.get('whatis', [])]
+				manhelp.update_index(index, whatis[dirname], keep=keep)
+
+		if self.verbose:
+			print 'rebuilt %d pages: %s' % (len(rebuilt),
+				', '.join(rebuilt))
+			print 'skipped %d pages: %s' % (len(skipped),
+				', '.join(skipped))
+
+		if failed:
+			raise distutils.errors.DistutilsExecError(
+			_('unable to build: %s') % ', '.join(failed)
+			)
 
 
 # add this command as a dependency to the build command
@@ -31,12 +31,25 @@ fine grained control of logging behaviour.
 import os
 import logging
 import logging.handlers
-import xdg.BaseDirectory
+import stat
 import errno
+import time
+import socket
+import struct
+import atexit
 
 _ = lambda x: x			# add fake gettext function until i fix up i18n
 DEFAULT_PATH = True
 
+# structured record header: created, levelno, len(name), len(payload). the
+# name and the json payload follow. the fixed offsets let a reader filter on
+# time, level and name without ever having to decode the json of a record.
+STRUCTURED_HEADER = struct.Struct('<dBHI')
+
+# a cache of which log file paths could be opened by this process, so that
+# lazy handlers don't retry paths (like those in /var/log) that have failed.
+_PROBES = {}
+
 # from: http://svn.python.org/view/python/trunk/Lib/logging/__init__.py?r1=66211&r2=67511
 # the above code is under the license for the logging module. it is here until
 # it gets backported or this logginghelp module gets updated to a newer version.
@@ -57,14 +70,695 @@ class NullHandler(logging.Handler):
 		pass
 
 
+class RingBufferHandler(logging.Handler):
+	"""
+	This handler keeps the last `capacity' records in a preallocated ring
+	buffer and writes nothing until a record at or above `flushlevel' is
+	seen, or until dump() is called explicitly. At that point, all of the
+	buffered records are passed in order to each of the target handlers.
+	Since logging.shutdown() flushes every handler at exit, flush() only
+	flushes the targets, so that a clean exit doesn't dump the buffer.
+	The records are stored unformatted (with their original args) so that
+	no formatting cost is paid for the records that are never flushed.
+	"""
+	def __init__(self, capacity, flushlevel=logging.ERROR, targets=None):
+		logging.Handler.__init__(self)
+		if capacity < 1:
+			raise ValueError('Ring buffer capacity must be positive.')
+		self.capacity = capacity
+		self.flushlevel = flushlevel
+		self.targets = []
+		if targets is not None: self.targets.extend(targets)
+		self.buffer = [None] * self.capacity	# preallocated slots
+		self.index = 0				# next slot to write
+		self.count = 0				# number of used slots
+
+	def add_target(self, target):
+		"""add a handler that receives the buffered records on flush."""
+		self.acquire()
+		try:
+			self.targets.append(target)
+		finally:
+			self.release()
+
+	def emit(self, record):
+		self.buffer[self.index] = record
+		self.index = (self.index + 1) % self.capacity
+		if self.count < self.capacity: self.count += 1
+		if record.levelno >= self.flushlevel:
+			self.dump()
+
+	def dump(self):
+		"""send the buffered records to the targets, oldest first."""
+		self.acquire()
+		try:
+			start = (self.index - self.count) % self.capacity
+			records = [self.buffer[(start + i) % self.capacity]
+				for i in range(self.count)]
+			self.buffer = [None] * self.capacity
+			self.index = 0
+			self.count = 0
+			for record in records:
+				for target in self.targets:
+					if record.levelno >= target.level:
+						target.handle(record)
+		finally:
+			self.release()
+
+	def flush(self):
+		"""flush the targets, but keep the buffered records."""
+		for target in self.targets:
+			target.flush()
+
+	def close(self):
+		"""drop the buffered records; they were never asked for."""
+		self.acquire()
+		try:
+			self.buffer = [None] * self.capacity
+			self.index = 0
+			self.count = 0
+			self.targets = []
+		finally:
+			self.release()
+		logging.Handler.close(self)
+
+
+class StructuredFileHandler(logging.handlers.RotatingFileHandler):
+	"""
+	This handler writes each record as a fixed size binary header followed
+	by the logger name and a json payload, instead of as padded text. Use
+	the StructuredLogReader class to read and filter these files quickly.
+	"""
+	def __init__(self, filename, maxBytes=0, backupCount=0):
+		logging.handlers.RotatingFileHandler.__init__(self, filename,
+			maxBytes=maxBytes, backupCount=backupCount, delay=True)
+		self.mode = 'ab'		# records are binary data
+		self.stream = self._open()	# fail early like the others
+
+	def pack(self, record):
+		"""return the binary representation of a single record."""
+		import json	# only import if needed
+		payload = {
+			'msg': record.getMessage(),
+			'levelname': record.levelname,
+			'pathname': record.pathname,
+			'lineno': record.lineno,
+			'funcName': record.funcName,
+			'process': record.process,
+			'thread': record.thread,
+		}
+		if record.exc_info:
+			formatter = self.formatter or logging._defaultFormatter
+			payload['exc_text'] = formatter.formatException(record.exc_info)
+		name = record.name.encode('utf-8')
+		payload = json.dumps(payload).encode('utf-8')
+		header = STRUCTURED_HEADER.pack(record.created,
+			min(record.levelno, 255), len(name), len(payload))
+		return header + name + payload
+
+	def emit(self, record):
+		try:
+			data = self.pack(record)
+			if self.stream is None:
+				self.stream = self._open()
+			if self.maxBytes > 0:
+				self.stream.seek(0, 2)
+				if self.stream.tell() + len(data) >= self.maxBytes:
+					self.doRollover()
+					if self.stream is None:	# with delay=True
+						self.stream = self._open()
+			self.stream.write(data)
+			self.flush()
+		except (KeyboardInterrupt, SystemExit):
+			raise
+		except:
+			self.handleError(record)
+
+
+class StructuredLogReader:
+	"""
+	Reads a file written by the StructuredFileHandler. The file is mapped
+	into memory and the fixed record headers are walked, so that only the
+	records which match the level, name and time filters get decoded.
+	"""
+	def __init__(self, filename):
+		self.filename = filename
+
+	def records(self, level=None, name=None, start=None, end=None):
+		"""yield the decoded records that match all of the filters.
+		level is a minimum level, name matches the logger and all of
+		its children, and start and end are timestamps (inclusive)."""
+		import json	# only import if needed
+		import mmap
+		if name is not None:
+			child = (name + '.').encode('utf-8')
+			name = name.encode('utf-8')
+
+		f = open(self.filename, 'rb')
+		try:
+			size = os.fstat(f.fileno()).st_size
+			if size == 0: return	# mmap can't map empty files
+			m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+
+		try:
+			offset = 0
+			h = STRUCTURED_HEADER.size
+			while offset + h <= size:
+				(created, levelno, namelen, payloadlen) = \
+				STRUCTURED_HEADER.unpack_from(m, offset)
+				first = offset + h
+				offset = first + namelen + payloadlen
+				if offset > size: break	# partly written by a crash
+				if level is not None and levelno < level: continue
+				if start is not None and created < start: continue
+				if end is not None and created > end: continue
+				n = m[first:first+namelen]
+				if name is not None and n != name and \
+				not n.startswith(child):
+					continue
+
+				record = json.loads(m[first+namelen:offset].decode('utf-8'))
+				record['created'] = created
+				record['levelno'] = levelno
+				record['name'] = n.decode('utf-8')
+				yield record
+		finally:
+			m.close()
+
+
+class RemoteSysLogHandler(logging.Handler):
+	"""
+	This handler sends RFC 5424 formatted syslog messages to a remote log
+	server over a persistent socket. Records are queued and sent in batches
+	of `batchsize', or sooner if a record is an error or if `interval' has
+	passed since the first record was queued, which a timer takes care of
+	when no more records arrive. Sockets use a `timeout', so that a dead
+	server can't hang the logging thread for long. Over tcp, a batch is octet-counted (RFC
+	6587) and sent with a single call; over udp every message has its own
+	datagram, as RFC 5426 requires. When sending fails, the socket is closed
+	and the records stay queued until a reconnect is attempted, after a
+	delay which doubles up to `maxbackoff'. If more than `maxqueue' records
+	are waiting, the oldest ones are dropped. The sent, dropped and retried
+	attributes count records.
+	"""
+	def __init__(self, address, facility='local7', appname='-',
+		protocol='udp', batchsize=16, interval=1.0, maxqueue=1024,
+		backoff=0.5, maxbackoff=30.0, timeout=5.0):
+		logging.Handler.__init__(self)
+		if protocol not in ['udp', 'tcp']:
+			raise ValueError('Protocol must be one of udp or tcp.')
+		if isinstance(facility, str):
+			facility = \
+			logging.handlers.SysLogHandler.facility_names[facility]
+		self.address = tuple(address)
+		self.facility = facility
+		self.appname = appname.replace(' ', '_')[:48] or '-'
+		self.protocol = protocol
+		self.batchsize = batchsize
+		self.interval = interval
+		self.maxqueue = maxqueue
+		self.backoff = backoff
+		self.maxbackoff = maxbackoff
+		self.timeout = timeout
+		self.hostname = socket.gethostname() or '-'
+
+		self.socket = None
+		self.queue = []			# formatted messages to send
+		self.delay = 0			# current reconnect backoff
+		self.retrytime = 0		# time of the next reconnect
+		self.lasttime = time.time()	# time of the last send
+		self.timer = None		# sends a quiet partial batch
+		self.closed = False
+		self.sent = 0
+		self.dropped = 0
+		self.retried = 0
+
+	def counters(self):
+		"""return a dict of the sent, dropped and retried counts."""
+		return {'sent': self.sent, 'dropped': self.dropped,
+			'retried': self.retried}
+
+	def rfc5424(self, record):
+		"""return the syslog message for a record as a utf-8 str."""
+		priority = logging.handlers.SysLogHandler.priority_names[
+			logging.handlers.SysLogHandler.priority_map.get(
+				record.levelname, 'warning')]
+		timestamp = time.strftime('%Y-%m-%dT%H:%M:%S',
+			time.gmtime(record.created))
+		timestamp += '.%06dZ' % ((record.created % 1) * 1000000)
+		msgid = record.name.replace(' ', '_')[:32] or '-'
+		msg = self.format(record)
+		if isinstance(msg, unicode): msg = msg.encode('utf-8')
+		return '<%d>1 %s %s %s %d %s - %s' % (
+			(self.facility << 3) | priority, timestamp,
+			self.hostname, self.appname, record.process, msgid, msg)
+
+	def connect(self):
+		"""open the socket, unless we are still backing off."""
+		if time.time() < self.retrytime: return False
+		try:
+			if self.protocol == 'tcp':
+				s = socket.create_connection(self.address,
+					self.timeout)
+			else:
+				s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+				s.settimeout(self.timeout)
+				s.connect(self.address)
+		except socket.error:
+			self.disconnect()
+			return False
+		self.socket = s
+		self.delay = 0
+		return True
+
+	def disconnect(self):
+		"""close the socket, and schedule the next reconnect."""
+		if self.socket is not None:
+			try: self.socket.close()
+			except socket.error: pass
+		self.socket = None
+		self.delay = min(max(self.delay * 2, self.backoff), self.maxbackoff)
+		self.retrytime = time.time() + self.delay
+
+	def emit(self, record):
+		try:
+			self.queue.append(self.rfc5424(record))
+			if len(self.queue) > self.maxqueue:
+				extra = len(self.queue) - self.maxqueue
+				del self.queue[:extra]
+				self.dropped += extra
+
+			if len(self.queue) >= self.batchsize or \
+			record.levelno >= logging.ERROR or \
+			time.time() - self.lasttime >= self.interval:
+				self.flush()
+			else:
+				self.schedule(self.interval)
+		except (KeyboardInterrupt, SystemExit):
+			raise
+		except:
+			self.handleError(record)
+
+	def flush(self):
+		"""send the queued messages in one batch, if we can connect."""
+		self.acquire()
+		try:
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+			if not self.queue: return
+			if self.socket is None and not self.connect():
+				return
+			count = 0		# messages that went out
+			try:
+				if self.protocol == 'tcp':
+					self.socket.sendall(''.join(['%d %s' %
+						(len(x), x) for x in self.queue]))
+					count = len(self.queue)
+				else:
+					for x in self.queue:
+						self.socket.send(x)
+						count += 1
+			except socket.error:
+				# a partial tcp batch gets resent, so may repeat
+				self.retried += len(self.queue) - count
+				self.disconnect()
+			self.sent += count
+			del self.queue[:count]
+		finally:
+			self.lasttime = time.time()
+			if self.queue and not self.closed:	# try again later
+				self.schedule(max(self.interval,
+					self.retrytime - self.lasttime))
+			self.release()
+
+	def schedule(self, delay):
+		"""flush after delay seconds, unless something else does first."""
+		if self.timer is None:
+			import threading	# only import if needed
+			self.timer = threading.Timer(delay, self.flush)
+			self.timer.daemon = True
+			self.timer.start()
+
+	def close(self):
+		self.acquire()
+		try:
+			self.retrytime = 0	# one last attempt
+			self.closed = True
+			self.flush()
+			self.dropped += len(self.queue)	# lost, if it failed
+			del self.queue[:]
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+			if self.socket is not None:
+				self.socket.close()
+				self.socket = None
+		finally:
+			self.release()
+		logging.Handler.close(self)
+
+
+class RateLimitFilter(logging.Filter):
+	"""
+	This filter samples (keeps one in `sampling') and then rate limits the
+	records of each logger and message template pair with a token bucket
+	that refills at `rate' records per second up to `burst' records. Each
+	check is a dict lookup and a little arithmetic, without any locking;
+	racing threads can only make the counts slightly approximate. Records
+	at or above `level' always pass. Every `interval' seconds, a warning
+	with the count of suppressed records is logged to each logger which
+	had some, either by the next record to pass, or by a timer if none do.
+	Call close() to report what is pending, such as at exit. To bound the
+	memory used, all of the state is reset past `maxkeys' keys.
+	"""
+	def __init__(self, sampling=None, rate=None, burst=None,
+		level=logging.ERROR, interval=60.0, maxkeys=4096):
+		logging.Filter.__init__(self)
+		self.sampling = sampling
+		self.rate = rate
+		if burst is None and rate is not None: burst = max(rate, 1)
+		self.burst = burst
+		self.level = level
+		self.interval = interval
+		self.maxkeys = maxkeys
+		self.state = {}			# key: [seen, tokens, last]
+		self.suppressed = {}		# logger name: count
+		self.nextreport = time.time() + self.interval
+		self.timer = None		# reports when records stop
+
+	def filter(self, record):
+		if getattr(record, 'ratelimit_summary', False): return True
+		now = time.time()
+		if now >= self.nextreport: self.report(now)
+		if record.levelno >= self.level: return True
+
+		key = (record.name, record.msg)
+		state = self.state.get(key)
+		if state is None:
+			if len(self.state) >= self.maxkeys: self.state.clear()
+			state = self.state[key] = [0, self.burst, now]
+
+		state[0] += 1
+		keep = True
+		if self.sampling is not None and (state[0] - 1) % self.sampling:
+			keep = False
+
+		elif self.rate is not None:
+			tokens = min(self.burst,
+				state[1] + (now - state[2]) * self.rate)
+			state[2] = now
+			if tokens >= 1:
+				state[1] = tokens - 1
+			else:
+				state[1] = tokens
+				keep = False
+
+		if not keep:
+			self.suppressed[record.name] = \
+			self.suppressed.get(record.name, 0) + 1
+			if self.timer is None:
+				import threading	# only import if needed
+				self.timer = threading.Timer(
+					max(self.nextreport - now, 0), self.report)
+				self.timer.daemon = True
+				self.timer.start()
+		return keep
+
+	def close(self):
+		"""report any suppressed records now, and stop the timer."""
+		self.report()
+
+	def report(self, now=None):
+		"""log a summary of the suppressed records and reset them."""
+		if now is None: now = time.time()
+		timer = self.timer
+		self.timer = None
+		if timer is not None:
+			import threading	# only import if needed
+			if timer is not threading.current_thread(): timer.cancel()
+		self.nextreport = now + self.interval
+		suppressed = self.suppressed
+		self.suppressed = {}
+		for (name, count) in suppressed.items():
+			msg = _('suppressed %d records from: %s')
+			logging.getLogger(name).warn(msg, count, name,
+				extra={'ratelimit_summary': True})
+
+
+class UnixSocketHandler(logging.handlers.SocketHandler):
+	"""
+	This is the stock SocketHandler, but over a unix domain socket. It is
+	used by the worker processes of a multiprocess logginghelp to send the
+	records to the writer, which is the one process that owns the files.
+	If the writer has gone away, failover(handler, record) gets called; it
+	returns true if it took care of the record, and otherwise we reconnect
+	to the new writer that it found, and send the record there instead. If
+	the failover set the targets, then records are handed to those instead
+	of to the socket, which saves changing the handlers of the logger while
+	it is in the middle of calling them.
+	"""
+	def __init__(self, path, failover=None):
+		logging.handlers.SocketHandler.__init__(self, path, None)
+		self.path = path
+		self.failover = failover
+		self.targets = None
+
+	def emit(self, record):
+		try:
+			if self.targets is not None:
+				for target in self.targets:
+					if record.levelno >= target.level:
+						target.handle(record)
+				return
+			data = self.makePickle(record)
+			for attempt in range(3):
+				try:
+					if self.sock is None:
+						self.sock = self.makeSocket()
+					self.sock.sendall(data)
+					return
+				except socket.error:
+					if self.sock is not None: self.sock.close()
+					self.sock = None
+				# the first retry may just be a stale connection
+				if attempt > 0 and self.failover is not None and \
+				self.failover(self, record):
+					return
+			raise socket.error(_('no log writer at: %s') % self.path)
+		except (KeyboardInterrupt, SystemExit):
+			raise
+		except:
+			self.handleError(record)
+
+	def makeSocket(self, timeout=1):
+		s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		s.settimeout(timeout)
+		s.connect(self.path)
+		return s
+
+
+_SERVER_CLASS = []	# made on first use, see: _server_class
+
+
+def _server_class():
+	"""returns the SocketServer class that the log writer serves with. it
+	is only made on first use, so only multiprocess logs import it all."""
+	if _SERVER_CLASS: return _SERVER_CLASS[0]
+	import cPickle
+	import SocketServer
+
+	class LogRecordStreamHandler(SocketServer.StreamRequestHandler):
+		"""Reads the length prefixed pickles sent by a UnixSocketHandler."""
+		def handle(self):
+			while True:
+				chunk = self.rfile.read(4)
+				if len(chunk) < 4: break
+				length = struct.unpack('>L', chunk)[0]
+				chunk = self.rfile.read(length)
+				if len(chunk) < length: break
+				record = logging.makeLogRecord(cPickle.loads(chunk))
+				self.server.dispatch(record)
+
+	class UnixLogServer(SocketServer.ThreadingMixIn,
+		SocketServer.UnixStreamServer):
+		daemon_threads = True
+		allow_reuse_address = True
+		request_queue_size = socket.SOMAXCONN	# many workers start at once
+
+		def __init__(self, path, dispatch):
+			SocketServer.UnixStreamServer.__init__(self, path,
+				LogRecordStreamHandler)
+			self.dispatch = dispatch
+
+	_SERVER_CLASS.append(UnixLogServer)
+	return UnixLogServer
+
+
+class LogRecordServer(object):
+	"""
+	This server runs in a thread of the writer process and passes all of
+	the records that the worker processes send it to the file handlers.
+	The socket is only accessible to the user, since it unpickles data.
+	"""
+	def __init__(self, path, handlers=None):
+		import threading
+		self.server = _server_class()(path, self.dispatch)
+		os.chmod(path, 0600)
+		self.path = path
+		self.handlers = []
+		if handlers is not None: self.handlers.extend(handlers)
+		self.received = 0
+		self.lock = threading.Lock()
+		self.thread = None
+
+	def dispatch(self, record):
+		"""hand a record over to the handlers that we own."""
+		for handler in self.handlers:
+			if record.levelno >= handler.level:
+				handler.handle(record)
+		self.lock.acquire()
+		try: self.received += 1
+		finally: self.lock.release()
+
+	def start(self):
+		"""serve in a daemon thread, and clean up the socket at exit."""
+		import threading
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.setDaemon(True)
+		self.thread.start()
+		atexit.register(self.stop)
+
+	def stop(self):
+		"""stop serving, and remove the socket file."""
+		if self.thread is not None:
+			self.server.shutdown()
+			self.thread = None
+		self.server.server_close()
+		try: os.unlink(self.path)
+		except OSError: pass
+
+	@classmethod
+	def claim(cls, path):
+		"""return a new server if we can become the writer for path,
+		or None if some other live process already is the writer. a
+		socket which isn't our own is never used, and raises OSError."""
+		import fcntl	# only import if needed, it's posix only
+		lock = open(path + '.lock', 'a')	# so peers claim in turn
+		try:
+			fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+			try:
+				return cls(path)
+			except socket.error, e:
+				if e.errno != errno.EADDRINUSE: raise
+
+			st = os.lstat(path)
+			if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+				raise OSError(errno.EPERM,
+					_('not our log socket'), path)
+
+			# is the socket stale, or is there still a writer around?
+			s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				s.connect(path)
+				return None
+			except socket.error, e:
+				if e.errno not in [errno.ECONNREFUSED, errno.ENOENT]:
+					raise
+			finally:
+				s.close()
+
+			try: os.unlink(path)
+			except OSError: pass
+			return cls(path)
+		finally:
+			lock.close()	# which also unlocks
+
+
+class LazyFileHandler(logging.Handler):
+	"""
+	This handler only creates the real file handler (with the factory) when
+	the first record reaches it, so that nothing is touched on disk by the
+	programs that never log anything at this level. The filename can be a
+	function which returns it, so that computing it is deferred as well. If
+	the file can't be opened, a warning is logged on the `log' logger once,
+	and this handler (and any other for that path) does nothing after that.
+	"""
+	def __init__(self, filename, factory, makedirs=False, log=None):
+		logging.Handler.__init__(self)
+		self.filename = filename
+		self.factory = factory
+		self.makedirs = makedirs	# create the parent directory
+		self.log = log
+		self.handler = None
+		self.failed = False
+
+	def open(self):
+		"""return the real handler, or None if it can't be opened."""
+		if self.handler is not None or self.failed: return self.handler
+		if callable(self.filename): self.filename = self.filename()
+		if _PROBES.get(self.filename) is False:
+			self.failed = True
+			return None
+		try:
+			if self.makedirs:
+				try:
+					os.makedirs(os.path.dirname(self.filename))
+				except OSError, e:
+					if e.errno != errno.EEXIST: raise
+			self.handler = self.factory(self.filename)
+			self.handler.setFormatter(self.formatter)
+			self.handler.setLevel(self.level)
+			_PROBES[self.filename] = True
+		except (IOError, OSError):
+			self.failed = True
+			_PROBES[self.filename] = False
+			if self.log is not None:
+				msg = _('unable to open `%s\' for logging messages.')
+				self.log.warn(msg % self.filename)
+		return self.handler
+
+	def emit(self, record):
+		handler = self.open()
+		if handler is not None:
+			handler.handle(record)
+
+	def close(self):
+		if self.handler is not None:
+			self.handler.close()
+		logging.Handler.close(self)
+
+
 class logginghelp:
 	def __init__(self, name, wordymode=True, stderrlog=True,
 		mylogpath=[DEFAULT_PATH], addxdglog=True, defxdgstr='messages',
-		logserver=None, logformat=None, showhello=False, mykerning=7):
+		logserver=None, logformat=None, showhello=False, mykerning=7,
+		ringbuffer=None, structured=False, logfacility='local7',
+		logprotocol=None, sampling=None, ratelimit=None,
+		multiprocess=False, lazy=False):
 		"""this class is meant to ease the use of the python logging
 		class. the code assumes some sensible defaults, and if you want
 		something different, then this class can probably be easily
-		changed to support the feature or parameter that you want."""
+		changed to support the feature or parameter that you want.
+		if ringbuffer is an integer, the last ringbuffer records are
+		held in memory and only written out to the handlers once an
+		error (or worse) is logged, or when dump() is called. if the
+		structured option is true, then the log files are written in
+		the binary format which the StructuredLogReader can filter.
+		if logprotocol is set to udp or tcp, then records are sent to
+		the logserver in batches over a persistent socket, with this
+		log name as the syslog app-name. sampling keeps one in every
+		sampling records, and ratelimit is a (rate, burst) tuple for a
+		token bucket, per logger and message template; errors are not
+		ever suppressed, and a summary of suppressions is logged. if
+		multiprocess is true, then the first process to use this name
+		becomes the writer which owns the log files, and the others
+		send their records to it over a unix socket. (posix only.) if
+		lazy is true, no directories or log files are created until a
+		record first needs to be written to them, which makes startup
+		cheap for short lived programs."""
 
 		# some variables
 		self.name = name			# a name for this log
@@ -74,11 +768,20 @@ class logginghelp:
 		self.addxdglog = addxdglog		# add on xdg log path
 		self.defxdgstr = defxdgstr		# default xdg string
 		self.logserver = logserver		# for remote syslog
+		self.logfacility = logfacility		# syslog facility name
+		self.logprotocol = logprotocol		# remote syslog protocol
 		self.logformat = logformat		# the format for all
 		self.mykerning = mykerning		# add extra kerning on
+		self.ringbuffer = ringbuffer		# buffered record count
+		self.structured = structured		# binary log files
+		self.sampling = sampling		# keep one in sampling
+		self.ratelimit = ratelimit		# (rate, burst) tuple
+		self.multiprocess = multiprocess	# single file writer
+		self.lazy = lazy			# defer opening files
 
 		# add a log file in an xdg compliant path
-		if self.addxdglog:
+		if self.addxdglog and not self.lazy:
+			import xdg.BaseDirectory	# only import if needed
 			temp = xdg.BaseDirectory.xdg_cache_home
 			self.__cache = os.path.join(temp, self.name)
 			try:
@@ -112,6 +815,9 @@ class logginghelp:
 		self.log = None			# main logger
 		self.logh = {}			# log handles
 		self.logs = {}			# other log handles
+		self.ring = None		# in memory ring buffer
+		self.limit = None		# sampling and rate limits
+		self.server = None		# multiprocess log writer
 
 		# do the logging init
 		self.__logging()
@@ -138,12 +844,28 @@ class logginghelp:
 		if self.wordymode: self.log.setLevel(logging.DEBUG)
 		else: self.log.setLevel(logging.WARN)
 
+		# logger filters don't see the records of children, so this is
+		# also added onto every logger that is returned by get_log()
+		if self.sampling is not None or self.ratelimit is not None:
+			(rate, burst) = (None, None)
+			if self.ratelimit is not None:
+				(rate, burst) = self.ratelimit
+			self.limit = RateLimitFilter(sampling=self.sampling,
+				rate=rate, burst=burst)
+			self.log.addFilter(self.limit)
+			atexit.register(self.limit.close)	# the last summary
+
+		# if requested, the ring buffer sits in front of every handler
+		if self.ringbuffer is not None:
+			self.ring = RingBufferHandler(self.ringbuffer)
+			self.log.addHandler(self.ring)
+
 		# add a nullhandler so that if no other handlers are present, we
 		# don't get the: `No handlers could be found for logger' message
 		# FIXME: the NullHandler is from the python code, and when it is
 		# backported to this python version (or if we use a later python
 		# version), then replace the NullHandler with the stock version.
-		self.logh['NullHandler'] = NullHandler(self.name)
+		self.logh['NullHandler'] = NullHandler()
 		self.logh['NullHandler'].setFormatter(formatter)
 		self.log.addHandler(self.logh['NullHandler'])
 		del self.logh['NullHandler']
@@ -152,20 +874,31 @@ class logginghelp:
 		if self.stderrlog:
 			self.logh['StreamHandler'] = logging.StreamHandler()
 			self.logh['StreamHandler'].setFormatter(formatter)
-			self.log.addHandler(self.logh['StreamHandler'])
+			self.__addhandler(self.logh['StreamHandler'])
 			del self.logh['StreamHandler']
 
 		# handler for global logging server
-		if self.logserver is not None:
-			# TODO: is there a way to change the facility to a
-			# specific name?
+		if self.logserver is not None and self.logprotocol is not None:
+			self.logh['SysLogHandler'] = \
+			RemoteSysLogHandler(
+				self.logserver,
+				facility=self.logfacility,
+				appname=self.name,
+				protocol=self.logprotocol
+			)
+			self.logh['SysLogHandler'].setFormatter(formatter)
+			self.__addhandler(self.logh['SysLogHandler'])
+			del self.logh['SysLogHandler']
+
+		elif self.logserver is not None:
 			self.logh['SysLogHandler'] = \
 			logging.handlers.SysLogHandler(
 				tuple(self.logserver),
-				logging.handlers.SysLogHandler.LOG_LOCAL7
+				logging.handlers.SysLogHandler.facility_names[
+					self.logfacility]
 			)
 			self.logh['SysLogHandler'].setFormatter(formatter)
-			self.log.addHandler(self.logh['SysLogHandler'])
+			self.__addhandler(self.logh['SysLogHandler'])
 			del self.logh['SysLogHandler']
 
 		# handler for windows event log
@@ -173,7 +906,7 @@ class logginghelp:
 			self.logh['NTEventLogHandler'] = \
 			logging.handlers.NTEventLogHandler(self.name)
 			self.logh['NTEventLogHandler'].setFormatter(formatter)
-			self.log.addHandler(self.logh['NTEventLogHandler'])
+			self.__addhandler(self.logh['NTEventLogHandler'])
 			del self.logh['NTEventLogHandler']
 
 		# handlers for local disk
@@ -182,16 +915,74 @@ class logginghelp:
 		# security hole, because the user might exploit the short time
 		# interval between checking and opening the file to manipulate
 		# it. do a try and catch instead.
-		for x in self.mylogpath:
+		self.__formatter = formatter
+		if self.multiprocess:
 			try:
-				self.logh['RotatingFileHandler'] = \
-				logging.handlers.RotatingFileHandler(
-					x,
-					maxBytes=1024*100,
-					backupCount=9
-				)
+				path = os.path.join(self.__rundir(), '%s.sock' % self.name)
+				self.server = LogRecordServer.claim(path)
+			except (socket.error, OSError, IOError), e:
+				msg = _('unable to share a log writer: %s')
+				self.log.warn(msg % e)
+				path = None	# so write the files ourselves
+
+			if path is not None and self.server is None:
+				# some other process is the writer, send it all
+				self.logh['UnixSocketHandler'] = \
+				UnixSocketHandler(path, failover=self.__failover)
+				self.__addhandler(self.logh['UnixSocketHandler'])
+				del self.logh['UnixSocketHandler']
+				msg = _('sending log messages to the writer at `%s\'.')
+				self.log.info(msg % path)
+				return
+
+		self.__files(formatter)
+
+
+	def __files(self, formatter, attach=True, handlers=None):
+		"""add the handlers for the log files, and start the writer if
+		we are one. this returns the list of handlers that were added,
+		which is the handlers list if given. if attach is false, then
+		they are only added to that list, and not to the logger."""
+		if handlers is None: handlers = []
+
+		def factory(x):
+			"""return a new rotating log file handler for path x."""
+			if self.structured:
+				handler = StructuredFileHandler
+			else:
+				handler = logging.handlers.RotatingFileHandler
+			return handler(x, maxBytes=1024*100, backupCount=9)
+
+		if self.lazy:
+			# no info messages here, since they'd open the files
+			lazypaths = [(x, False) for x in self.mylogpath]
+			if self.addxdglog: lazypaths.append((self.__xdgpath, True))
+			for (x, makedirs) in lazypaths:
+				self.logh['LazyFileHandler'] = \
+				LazyFileHandler(x, factory, makedirs=makedirs,
+					log=self.log)
+				self.logh['LazyFileHandler'].setFormatter(formatter)
+				if attach: self.__addhandler(self.logh['LazyFileHandler'])
+				handlers.append(self.logh['LazyFileHandler'])
+				if self.server is not None:
+					self.server.handlers.append(
+						self.logh['LazyFileHandler'])
+				del self.logh['LazyFileHandler']
+			paths = []		# skip the eager handlers below
+
+		else:
+			paths = self.mylogpath
+
+		for x in paths:
+			try:
+				self.logh['RotatingFileHandler'] = factory(x)
 				self.logh['RotatingFileHandler'].setFormatter(formatter)
-				self.log.addHandler(self.logh['RotatingFileHandler'])
+				if attach:
+					self.__addhandler(self.logh['RotatingFileHandler'])
+				handlers.append(self.logh['RotatingFileHandler'])
+				if self.server is not None:
+					self.server.handlers.append(
+						self.logh['RotatingFileHandler'])
 				msg = _('using `%s\' for logging messages.')
 				self.log.info(msg % x)
 
@@ -205,6 +996,71 @@ class logginghelp:
 				if 'RotatingFileHandler' in self.logh:
 					del self.logh['RotatingFileHandler']
 
+		if self.server is not None:
+			self.server.start()
+		return handlers
+
+
+	def __rundir(self):
+		"""return a directory for the writer sockets that only we can
+		use, since a socket in a shared directory could be hijacked."""
+		path = os.getenv('XDG_RUNTIME_DIR')
+		if not path:
+			import xdg.BaseDirectory	# only import if needed
+			path = xdg.BaseDirectory.xdg_cache_home
+		path = os.path.join(path, 'logginghelp')
+		try:
+			os.makedirs(path, 0700)
+		except OSError, e:
+			if e.errno != errno.EEXIST: raise
+		st = os.lstat(path)
+		if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+		st.st_mode & 077:
+			raise OSError(errno.EPERM, _('unsafe socket directory'), path)
+		return path
+
+
+	def __failover(self, handler, record):
+		"""the writer went away, so try to become the new writer. if we
+		do, then the record is written and true is returned. if a peer
+		beat us to it, return false so the handler sends to that peer."""
+		try:
+			self.server = LogRecordServer.claim(handler.path)
+			if self.server is None: return False
+		except (socket.error, OSError, IOError):
+			self.server = None	# so write the files ourselves
+
+		# the logger is still calling its handlers, so this handler
+		# hands the records to the files, rather than being replaced.
+		handler.failover = None
+		handler.targets = []	# filled as they open, for their messages
+		self.__files(self.__formatter, attach=False,
+			handlers=handler.targets)
+		for x in handler.targets:
+			if record.levelno >= x.level: x.handle(record)
+		return True
+
+
+	def __xdgpath(self):
+		"""return the path of the log file in the xdg cache directory."""
+		import xdg.BaseDirectory	# only import if needed
+		temp = os.path.join(xdg.BaseDirectory.xdg_cache_home, self.name)
+		return os.path.join(temp, '%s.log' % self.defxdgstr)
+
+
+	def __addhandler(self, handler):
+		"""attach a handler to the logger, or behind the ring buffer."""
+		if self.ring is None:
+			self.log.addHandler(handler)
+		else:
+			self.ring.add_target(handler)
+
+
+	def dump(self):
+		"""write out the contents of the ring buffer, if there is one."""
+		if self.ring is not None:
+			self.ring.dump()
+
 
 	def get_log(self, name=None):
 		"""return a handle to the main logger or optionally to
@@ -223,11 +1079,110 @@ class logginghelp:
 			# in the x.y tree
 			self.logs[name] = \
 			logging.getLogger('%s.%s' % (self.name, name))
+			if self.limit is not None:
+				self.logs[name].addFilter(self.limit)
 			return self.logs[name]
 
 
+def _benchmark_worker(name, records, start):
+	"""log records to the multiprocess writer once start is set."""
+	start.wait()
+	obj = logginghelp(name, stderrlog=False, mylogpath=[],
+		addxdglog=False, multiprocess=True)
+	log = obj.get_log('worker')
+	for i in xrange(records):
+		log.info('record number %d from %d', i, os.getpid())
+	logging.shutdown()
+
+
+def benchmark_multiprocess(processes=(1, 4, 16), records=5000):
+	"""time how fast records from many processes reach the writer. this
+	returns a list of (number of processes, records per second) tuples."""
+	import tempfile
+	import multiprocessing
+	results = []
+	directory = tempfile.mkdtemp()
+	for n in processes:
+		name = 'logginghelp-benchmark-%d-%d' % (os.getpid(), n)
+		start = multiprocessing.Event()
+		# fork the workers first, so they don't inherit our handlers
+		workers = [multiprocessing.Process(target=_benchmark_worker,
+			args=(name, records, start)) for i in range(n)]
+		for w in workers: w.start()
+
+		obj = logginghelp(name, stderrlog=False, addxdglog=False,
+			mylogpath=[os.path.join(directory, '%s.log' % name)],
+			multiprocess=True)
+		expected = n * (records + 1)	# plus each `sending' message
+		t = time.time()
+		start.set()
+		for w in workers: w.join()
+		while obj.server.received < expected and time.time() - t < 60:
+			time.sleep(0.01)
+		t = time.time() - t
+		results.append((n, obj.server.received / t))
+
+		obj.server.stop()
+		os.unlink(obj.server.path + '.lock')
+		for h in obj.log.handlers: h.close()
+		obj.log.handlers = []
+
+	for x in os.listdir(directory): os.unlink(os.path.join(directory, x))
+	os.rmdir(directory)
+	return results
+
+
+def benchmark_startup(runs=20):
+	"""time how long a new process takes to import this module and build
+	a logginghelp, both normally and lazily. this returns a list of (mode,
+	mean seconds per process) tuples. the logs go to a temporary directory
+	which is also the xdg cache, so that nothing real is written to."""
+	import sys
+	import shutil
+	import tempfile
+	import subprocess
+	code = 'import sys; sys.path.insert(0, %r); import logginghelp; ' \
+	'logginghelp.logginghelp(%r, stderrlog=False, mylogpath=[%r], lazy=%r)'
+	directory = os.path.dirname(os.path.abspath(__file__))
+	temp = tempfile.mkdtemp()
+	env = dict(os.environ)
+	env['XDG_CACHE_HOME'] = temp
+	results = []
+	try:
+		for lazy in [False, True]:
+			cmd = [sys.executable, '-c', code % (directory,
+				'logginghelp-benchmark',
+				os.path.join(temp, 'benchmark.log'), lazy)]
+			t = time.time()
+			for i in range(runs):
+				subprocess.check_call(cmd, env=env)
+			results.append((['eager', 'lazy'][lazy],
+				(time.time() - t) / runs))
+	finally:
+		shutil.rmtree(temp)
+	return results
+
+
 if __name__ == '__main__':
 	import sys
+	import optparse
+	parser = optparse.OptionParser()
+	parser.add_option('-b', '--benchmark', dest='benchmark',
+		choices=['multiprocess', 'startup'], metavar=_('<name>'),
+		help=_('run this benchmark')
+	)
+	(options, args) = parser.parse_args()
+
+	if options.benchmark == 'multiprocess':
+		for (n, rate) in benchmark_multiprocess():
+			print _('%2d processes: %9.1f records/s') % (n, rate)
+		sys.exit()
+
+	elif options.benchmark == 'startup':
+		for (mode, t) in benchmark_startup():
+			print _('%5s: %6.1f ms per process') % (mode, t * 1000)
+		sys.exit()
+
 	name = os.path.splitext(os.path.basename(__file__))[0]
 	obj = logginghelp(name, showhello=True, mykerning=3, defxdgstr=name)
 	log = obj.get_log()
@@ -6,7 +6,8 @@ Manhelp wrapper to simplify creation of man pages.
 If you don't want to use a higher level documentation system, manhelp is a
 simple, direct way (based on magic templates) to write *roff manuals, without
 remembering nearly as much *roff as someone much more hardcore would expect you
-to.
+to. Pages can be Cheetah templates, or plain python functions which build the
+page with the document class, in which case Cheetah isn't needed at all.
 """
 # Copyright (C) 2009-2010  James Shubin, McGill University
 # Written for McGill University by James Shubin <purpleidea@gmail.com>
@@ -33,17 +34,216 @@ to.
 import os
 import re
 import sys
+import bz2
 import gzip
+import imp
+import ast
+import mmap
+import stat
+import errno
+import hashlib
+import tempfile
 import subprocess
-import Cheetah.Template
-import Cheetah.NameMapper
 _ = lambda x: x			# add fake gettext function until i fix up i18n
 
-__all__ = ['manhelp', 'install', 'formatting', 'acquire_namespace']
+__all__ = ['manhelp', 'install', 'formatting', 'acquire_namespace',
+	'template_class', 'guess', 'groff', 'groff_batch', 'compressor',
+	'document', 'whatis_scanner', 'update_index', 'lookup_index']
+
+# the name of the whatis index fragment that is written next to the pages
+INDEX = 'whatis'
+
+
+# the man page compression formats that man-db understands, and extensions
+COMPRESSION = {'gzip': '.gz', 'bzip2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}
+
+# compiled template classes are kept here, keyed by the sha1 of the source,
+# and template files are mapped to their (mtime, sha1) so that an unchanged
+# file doesn't even get read again. the generated python modules are saved
+# to the cache dir as well, so that another process can skip compiling too.
+_COMPILED = {}
+_SOURCES = {}
+
+# acquired namespaces, keyed by their identifier, along with the mtime of the
+# module that they came from. forked workers inherit this, so acquiring them
+# once before forking shares the result with every page of a parallel build.
+_NAMESPACES = {}
+
+
+def template_cachedir():
+	"""returns the default directory to cache compiled templates in, or
+	None if pyxdg isn't installed, in which case only memory is used."""
+	try:
+		import xdg.BaseDirectory	# only import if needed
+	except ImportError:
+		return None
+	return os.path.join(xdg.BaseDirectory.xdg_cache_home,
+		os.path.splitext(os.path.basename(__file__))[0])
+
+
+def template_class(template, cachedir=True):
+	"""returns the compiled Cheetah template class for the template file
+	or template source string. compilation is skipped when the template
+	is found in memory or in the cachedir. if cachedir is True, then the
+	default one is used, and if it is None, then only memory is used.
+	the cache is keyed on the Cheetah version too, since the compiled
+	code changes with it, and a bad cached module is just recompiled."""
+	import Cheetah.Template		# only import if needed
+	from Cheetah.Version import Version	# the package shadows the module
+	version = Version + '\0'
+	source = None
+	if os.path.isfile(template):
+		mtime = os.stat(template).st_mtime
+		entry = _SOURCES.get(template)
+		if entry is not None and entry[0] == mtime:
+			digest = entry[1]
+		else:
+			f = open(template, 'r')
+			try: source = f.read()
+			finally: f.close()
+			digest = hashlib.sha1(version + source).hexdigest()
+			_SOURCES[template] = (mtime, digest)
+	else:
+		source = template
+		digest = hashlib.sha1(version + source).hexdigest()
+
+	if digest in _COMPILED: return _COMPILED[digest]
+	if source is None:	# the compiled class was dropped from memory
+		del _SOURCES[template]
+		return template_class(template, cachedir=cachedir)
+
+	klass = None
+	name = 'manhelp_%s' % digest
+	if cachedir is True: cachedir = template_cachedir()
+	if cachedir is not None:
+		filename = os.path.join(cachedir, '%s.py' % name)
+		for attempt in range(2):
+			try:
+				klass = _load_template(source, name, filename, cachedir)
+				break
+			except (IOError, OSError), e:
+				break	# fall back on compiling in memory
+			except Exception, e:	# a broken or a foreign module
+				for x in [filename, filename + 'c']:
+					try: os.unlink(x)
+					except OSError: pass
+
+	if klass is None:
+		klass = Cheetah.Template.Template.compile(source=source,
+			moduleName=name, className=name)
+
+	_COMPILED[digest] = klass
+	return klass
+
+
+def _load_template(source, name, filename, cachedir):
+	"""load the compiled template class from the module in the cachedir,
+	and first compile the source and write it there, if it is missing.
+	the module is only run if nobody else could have written it."""
+	import Cheetah.Template		# only import if needed
+	if not os.path.isfile(filename):
+		code = Cheetah.Template.Template.compile(
+			source=source, returnAClass=False,
+			moduleName=name, className=name)
+		try:
+			os.makedirs(cachedir, 0700)
+		except OSError, e:
+			if e.errno != errno.EEXIST: raise
+		# write atomically, in case of a concurrent build
+		(fd, temp) = tempfile.mkstemp(dir=cachedir,
+			suffix='.tmp')
+		f = os.fdopen(fd, 'w')
+		try: f.write(code)
+		finally: f.close()
+		os.rename(temp, filename)
+
+	# like the yamlhelp snapshots, only trust what is ours alone
+	for x in [cachedir, filename, filename + 'c']:
+		try:
+			st = os.lstat(x)
+		except OSError, e:
+			if e.errno == errno.ENOENT and x != filename: continue
+			raise
+		if st.st_uid != os.getuid() or \
+		st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+			raise OSError(errno.EPERM, _('untrusted cache'), x)
+
+	# this also caches the bytecode next to the module
+	return getattr(imp.load_source(name, filename), name)
+
+
+class StreamTransaction:
+	"""A minimal Cheetah transaction, which hands all of the output that a
+	template produces to the write function, as soon as it is produced."""
+	def __init__(self, write):
+		self.__write = write
+
+	def response(self):
+		return self
+
+	def write(self, value):
+		if isinstance(value, unicode): value = value.encode('utf-8')
+		self.__write(value)
+
+
+class compressor:
+	"""A write only file, which compresses everything written into it with
+	the chosen compression format and level. The gzip header contains the
+	given mtime and no filename, so that the output is reproducible. The
+	xz and zstd formats are compressed by piping through those commands."""
+	def __init__(self, filename, compression='gzip', level=9, mtime=0):
+		if compression not in COMPRESSION:
+			raise ValueError('Unknown compression: %s.' % compression)
+		self.compression = compression
+		self.f = open(filename, 'wb')
+		try:
+			if compression == 'gzip':
+				self.z = gzip.GzipFile(filename='', mode='wb',
+					compresslevel=level, fileobj=self.f,
+					mtime=mtime)
+			elif compression == 'bzip2':
+				self.z = bz2.BZ2Compressor(level)
+			else:
+				cmd = [compression, '-%d' % level, '-q', '-c']
+				self.z = subprocess.Popen(cmd,
+					stdin=subprocess.PIPE, stdout=self.f)
+		except:
+			self.f.close()
+			raise
+
+	def write(self, data):
+		if self.compression == 'gzip':
+			self.z.write(data)
+		elif self.compression == 'bzip2':
+			self.f.write(self.z.compress(data))
+		else:
+			self.z.stdin.write(data)
+
+	def close(self):
+		try:
+			if self.compression == 'gzip':
+				self.z.close()
+			elif self.compression == 'bzip2':
+				self.f.write(self.z.flush())
+			else:
+				self.z.stdin.close()
+				if self.z.wait() != 0:
+					raise IOError('%s failed with: %d' %
+						(self.compression, self.z.returncode))
+		finally:
+			self.f.close()
+
 
 class manhelp:
 
-	def __init__(self, template, namespace={}):
+	def __init__(self, template, namespace={}, cachedir=True,
+		stream=False):
+		"""render the template with the namespace. if stream is true,
+		then the groff is only produced as the output methods write
+		it out, and self.groff stays None, to avoid keeping it all.
+		the template can also be a function, which gets called with
+		a new document and the namespace to build the page without
+		Cheetah; then the name and section# come from its header."""
 
 		self.template = template
 		self.namespace = namespace
@@ -51,37 +251,80 @@ class manhelp:
 		self.name = None
 		self.section = None
 		self.dirname = None
+		self.grofferror = None	# stderr of the last groff run
+		self.whatis = None	# (name, section, description) list
+
+		# process a native page
+		if callable(self.template):
+			self.page = None
+			doc = document()
+			self.template(doc, namespace)
+			self.groff = str(doc)
+			self.render(lambda x: None)	# for the whatis entries
+			if doc.page is None: self.guessed = False
+			else:
+				(self.name, self.section) = doc.page
+				self.dirname = os.curdir
+			return
 
 		# process template
+		klass = template_class(self.template, cachedir=cachedir)
+		self.page = klass(searchList=[namespace])
+		self.groff = None
 		if os.path.isfile(self.template):
-			self.groff = Cheetah.Template.Template(file=template, searchList=[namespace])
-			# pattern: <name>.<section#>.template
-			r = r'(?P<name>\w+).(?P<section>[1-9]).template'
-			m = re.match(r, os.path.basename(self.template))
-			if m is None: self.guessed = False
+			guessed = guess(self.template)
+			if guessed is None: self.guessed = False
 			else:
-				self.name = m.group('name')
-				self.section = int(m.group('section'))
+				(self.name, self.section) = guessed
 				self.dirname = os.path.dirname(self.template)
 		else:
-			self.groff = Cheetah.Template.Template(template, searchList=[namespace])
 			# TODO: in this case, we could add a simple parser or re
 			# that goes through the template to find the guess data.
 			self.guessed = False	# until then, it has to be false
 
 		# make the groff...
+		if not stream: self.text()
+
+
+	def render(self, write):
+		"""pass the groff output to the write function in chunks, as
+		the template produces it. returns False on namespace errors.
+		the whatis entries of the page are collected along the way."""
+		scanner = whatis_scanner()
+		def tee(chunk):
+			scanner.feed(chunk)
+			write(chunk)
+
+		if self.groff is not None:
+			tee(self.groff)
+			self.whatis = scanner.entries()
+			return True
+		import Cheetah.NameMapper	# only import if needed
 		try:
-			self.groff = str(self.groff)	# runs the NameMapper
+			self.page.respond(trans=StreamTransaction(tee))
+			self.whatis = scanner.entries()
+			return True	# the above runs the NameMapper
 		except Cheetah.NameMapper.NotFound, e:
 			print >> sys.stderr, _('namespace error: %s' % e)
-			self.groff = ''
+			return False
+
+
+	def text(self):
+		"""return the groff output as a string, rendering if needed."""
+		if self.groff is None:
+			chunks = []
+			if self.render(chunks.append):
+				self.groff = ''.join(chunks)
+			else:
+				self.groff = ''
+		return self.groff
 
 
 	def tostdout(self):
 		"""write groff output to stdout."""
 		try:
 			f = sys.stdout
-			f.write(self.groff)
+			self.render(f.write)
 			f.close()
 			return True
 		except IOError, e:
@@ -99,53 +342,121 @@ class manhelp:
 
 		try:
 			f = open(filename, 'w+')
-			f.write(self.groff)
+			self.render(f.write)
 			f.close()
 			return True
 		except IOError, e:
 			return False
 
 
-	def topsfile(self, dirname=None):
-		"""write groff man page output to a postscript (.ps) file."""
+	def topsfile(self, dirname=None, device='ps'):
+		"""write groff man page output to a postscript (.ps) file, or
+		to another groff output device, such as pdf (.pdf) instead."""
 		# NOTE: this function requires the *guess* capability. i enforce
-		# this so that the tofile() function can have a standard spot to
-		# put it's output. this way we don't have to think about finding
-		# a temporary filename for the initial manpage that gets created
-
+		# this so that the output has a standard spot and name to go to.
 		if self.guessed:
 			if dirname is None: dirname = self.dirname
-			filename = os.path.join(dirname, '%s.%d' % (self.name, self.section))
+			filename = os.path.join(dirname, '%s.%d.%s' % (self.name, self.section, device))
 		else:
 			return False
 
-		self.tofile(dirname=dirname)	# make normal man page
-		if not os.path.isfile(filename): return False
-		try:
-			f = open('%s.ps' % filename, 'w+')
-			# groff -t -e -mandoc -Tps manpage.1 > manpage.1.ps
-			cmd = ['groff', '-t', '-e', '-mandoc', '-Tps', filename]
-			p = subprocess.Popen(cmd, stdout=f)
-			f.close()
-			return True
-		except IOError, e:
-			return False
+		(status, error) = groff(self.text(), filename, device=device)
+		self.grofferror = error
+		return status == 0
 
 
-	def togzipfile(self, filename=None):
+	def togzipfile(self, filename=None, level=9, mtime=0):
 		"""write groff man page output to a gzip (.gz) file."""
+		return self.tocompressedfile(filename, 'gzip', level, mtime)
+
+
+	def tocompressedfile(self, filename=None, compression='gzip',
+		level=9, mtime=0):
+		"""write groff man page output to a compressed file, which is
+		streamed from the template. the compression is one of: gzip,
+		bzip2, xz or zstd, and the gzip header has the given mtime."""
 		if filename is None:
 			if self.guessed:
-				filename = os.path.join(self.dirname, '%s.%d.gz' % (self.name, self.section))
+				filename = os.path.join(self.dirname, '%s.%d%s' % (self.name, self.section, COMPRESSION[compression]))
 			else:
 				return False
 		try:
-			f = gzip.open(filename, 'wb')
-			f.write(self.groff)
-			f.close()
-			return True
-		except IOError, e:
-			return False
+			f = compressor(filename, compression, level, mtime)
+			try:
+				result = self.render(f.write)
+			finally:
+				f.close()
+		except (IOError, OSError), e:
+			result = False
+		if not result:
+			try: os.unlink(filename)
+			except OSError: pass
+		return result
+
+
+def groff(source, filename, device='ps'):
+	"""run groff on the source, which is streamed to it over stdin, and
+	write the output for device into filename. this waits for groff, and
+	returns an (exit status, stderr) tuple. the exit status is None if
+	groff couldn't be run at all, in which case stderr explains why. if
+	groff fails, then the partial output file is removed."""
+	# groff -t -e -mandoc -Tps < manpage.1 > manpage.1.ps
+	cmd = ['groff', '-t', '-e', '-mandoc', '-T%s' % device]
+	try:
+		f = open(filename, 'wb')
+	except IOError, e:
+		return (None, str(e))
+	status = None
+	try:
+		try:
+			p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+				stdout=f, stderr=subprocess.PIPE)
+		except OSError, e:
+			return (None, str(e))
+		(out, error) = p.communicate(source)
+		status = p.returncode
+		return (status, error)
+	finally:
+		f.close()
+		if status != 0:	# don't leave empty or partial output
+			try: os.unlink(filename)
+			except OSError: pass
+
+
+def groff_batch(jobs, maxprocs=4, device='ps'):
+	"""run groff for each (source, filename) tuple in the jobs list, with
+	at most maxprocs groff processes at once. this returns the list of
+	(filename, exit status, stderr) tuples in the same order as jobs."""
+	import Queue
+	import threading
+	results = [None] * len(jobs)
+	queue = Queue.Queue()
+	for (i, job) in enumerate(jobs): queue.put((i, job))
+
+	def worker():
+		"""run queued groff jobs until there aren't any left."""
+		while True:
+			try:
+				(i, (source, filename)) = queue.get_nowait()
+			except Queue.Empty:
+				return
+			(status, error) = groff(source, filename, device=device)
+			results[i] = (filename, status, error)
+
+	threads = [threading.Thread(target=worker)
+		for i in range(max(1, min(maxprocs, len(jobs))))]
+	for t in threads: t.start()
+	for t in threads: t.join()
+	return results
+
+
+def guess(template):
+	"""returns the (name, section#) tuple for a template filename which
+	matches the pattern: <name>.<section#>.template or None otherwise."""
+	r = r'(?P<name>\w+).(?P<section>[1-9]).template'
+	m = re.match(r, os.path.basename(template))
+	if m is None: return None
+	return (m.group('name'), int(m.group('section')))
 
 
 def formatting():
@@ -215,26 +526,228 @@ def formatting():
 	}
 
 
+class document:
+	"""A pure python groff document builder. Each method adds the output of
+	the matching formatting() helper as a line, and returns the document so
+	that calls can be chained. Use str() on it to get all of the groff."""
+	def __init__(self):
+		self.lines = []
+		self.page = None	# (name, section#) from the header()
+		self.f = _formatting()
+
+	def __str__(self):
+		return '\n'.join(self.lines) + '\n'
+
+	def add(self, line):
+		"""add a line of groff or text as is."""
+		self.lines.append(line)
+		return self
+
+	def header(self, name, section, date, version, title=''):
+		self.page = (name.lower(), section)
+		return self.add(self.f['header'](name, section, date, version, title))
+
+	def name_description(self, name, description):
+		return self.add(self.f['name_description'](name, description))
+
+	def section(self, name):
+		return self.add(self.f['section'](name))
+
+	def option(self, long=None, short=None, description=None, meta=None):
+		return self.add(self.f['option'](long, short, description, meta))
+
+	def br(self):
+		return self.add(self.f['break']())
+
+	def bold(self, text):
+		return self.add(self.f['bold'](text))
+
+	def underline(self, text):
+		return self.add(self.f['underline'](text))
+
+	def seealso(self, entries):
+		return self.add(self.f['seealso'](entries))
+
+	def code(self, text):
+		return self.add(self.f['code'](text))
+
+
+_FORMATTING = None
+def _formatting():
+	"""returns a formatting() dict which is shared by all documents."""
+	global _FORMATTING
+	if _FORMATTING is None: _FORMATTING = formatting()
+	return _FORMATTING
+
+
+class whatis_scanner:
+	"""Finds the whatis entries of a page in its groff, which can be fed in
+	chunks as it is rendered. The section comes from the .TH line and the
+	names and description come from the text of the NAME section, which is
+	of the form: name[, name...] \- description. Once the NAME section has
+	ended, the rest of the page is ignored without even splitting lines."""
+	def __init__(self):
+		self.buffer = ''
+		self.section = None
+		self.text = None	# lines of the NAME section, when in it
+		self.done = False
+
+	def feed(self, chunk):
+		"""scan another chunk of groff."""
+		if self.done: return
+		self.buffer += chunk
+		lines = self.buffer.split('\n')
+		self.buffer = lines.pop()	# an incomplete line
+		for line in lines:
+			self.line(line)
+			if self.done: break
+
+	def line(self, line):
+		"""scan a single complete line of groff."""
+		if line.startswith('.TH '):
+			fields = line.split()
+			if len(fields) > 2: self.section = fields[2]
+		elif line.startswith('.SH'):
+			if self.text is not None:
+				self.done = True
+			elif line[3:].strip().strip('"').upper() == 'NAME':
+				self.text = []
+		elif self.text is not None and not line.startswith('.'):
+			self.text.append(line.strip())
+
+	def entries(self):
+		"""return the list of (name, section, description) tuples."""
+		if self.buffer and not self.done: self.line(self.buffer)
+		self.buffer = ''
+		if not self.text or self.section is None: return []
+		text = ' '.join(self.text)
+		if '\\-' not in text: return []
+		(names, description) = text.split('\\-', 1)
+		return [(x.strip(), self.section, description.strip())
+			for x in names.split(',') if x.strip()]
+
+
+def index_line(name, section, description):
+	"""returns the whatis index line for one entry."""
+	return '%s (%s) - %s' % (name, section, description)
+
+
+def read_index(filename):
+	"""returns the sorted list of lines in a whatis index file."""
+	try:
+		f = open(filename, 'r')
+	except IOError:
+		return []
+	try:
+		return sorted([x.rstrip('\n') for x in f if x.strip()])
+	finally:
+		f.close()
+
+
+def update_index(filename, entries, keep=None):
+	"""add the (name, section, description) entries to the whatis index
+	file, replacing any previous lines with the same name and section.
+	this lets you index just the pages that were built, incrementally.
+	if keep is a list of (name, section) tuples, then the old lines of
+	any other pages are pruned, such as those of a removed page."""
+	keys = set(['%s (%s)' % (x[0], x[1]) for x in entries])
+	if keep is not None: keep = set(['%s (%s)' % x for x in keep])
+	lines = [x for x in read_index(filename)
+		if x.split(' - ', 1)[0] not in keys and
+		(keep is None or x.split(' - ', 1)[0] in keep)]
+	lines.extend([index_line(*x) for x in entries])
+	lines.sort()
+	(fd, temp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+	f = os.fdopen(fd, 'w')
+	try:
+		f.write(''.join([x + '\n' for x in lines]))
+	finally:
+		f.close()
+	os.chmod(temp, 0644)
+	os.rename(temp, filename)
+
+
+def lookup_index(filename, keyword, apropos=False):
+	"""returns the lines of the whatis index with the name keyword, like
+	whatis does, or if apropos is true, those with keyword anywhere in the
+	name or description, ignoring case. whatis lookups bisect the file
+	in place, since update_index keeps it sorted, so only a few lines of
+	it are ever read, no matter how big the index gets."""
+	try:
+		f = open(filename, 'rb')
+	except IOError:
+		return []
+	try:
+		if apropos:
+			keyword = keyword.lower()
+			return [x.rstrip('\n') for x in f if keyword in x.lower()]
+		if os.fstat(f.fileno()).st_size == 0: return []
+		m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+		f.close()
+
+	try:
+		prefix = '%s (' % keyword
+		(lo, hi) = (0, len(m))	# both always at the start of a line
+		while lo < hi:
+			mid = (lo + hi) // 2
+			start = m.rfind('\n', lo, mid) + 1 or lo
+			end = m.find('\n', start)
+			if end < 0: end = len(m)
+			if m[start:end] < prefix: lo = end + 1
+			else: hi = start
+		result = []
+		while lo < len(m):
+			end = m.find('\n', lo)
+			if end < 0: end = len(m)
+			line = m[lo:end]
+			if not line.startswith(prefix): break
+			result.append(line)
+			lo = end + 1
+		return result
+	finally:
+		m.close()
+
+
 def install(namespace, index=os.path.splitext(os.path.basename(__file__))[0]):
 	"""adds the manhelp groff template helpers into index of namespace."""
 	namespace[index] = formatting()
 
 
+def module_mtime(module):
+	"""returns the mtime of the source of a module, or None if unknown."""
+	filename = getattr(module, '__file__', None)
+	if filename is None: return None
+	if os.path.splitext(filename)[1] in ['.pyc', '.pyo'] and \
+	os.path.isfile(filename[:-1]):
+		filename = filename[:-1]
+	try:
+		return os.stat(filename).st_mtime
+	except OSError:
+		return None
+
+
 def acquire_namespace(namespace, verbose=False):
 	"""attempt to acquire namespace data that corresponds to the
 	magic namespace identifier, e.g. {name:value} or module:func
-	if no valid data can be found, then return an empty dict."""
+	if no valid data can be found, then return an empty dict. the
+	results are memoized until the module's source file changes."""
 
+	spec = None	# the identifier to memoize the result with
+	mtime = None
 	# attempt to get a function or value externally
 	if type(namespace) is str:
 		namespace = namespace.strip()	# cleanup
-		# looks like we might have a literal dictionary to eval()
+		spec = namespace
+		cached = _NAMESPACES.get(spec)
+		# looks like we might have a literal dictionary to parse
 		if (namespace[0], namespace[-1]) == ('{', '}'):
+			if cached is not None: return dict(cached[1])
 			if verbose:
 				print >> sys.stderr, _('trying to parse a dictionary...')
 			try:
-				namespace = eval(namespace)
-			except SyntaxError, e:
+				namespace = ast.literal_eval(namespace)
+			except (SyntaxError, ValueError), e:
 				print >> sys.stderr, _('error: %s, while parsing:' % e)
 				print >> sys.stderr, '%s' % namespace
 				return {}	# set a default
@@ -246,6 +759,12 @@ def acquire_namespace(namespace, verbose=False):
 			name, attr = namespace.split(':')
 			try:
 				module = __import__(name, fromlist=name.split('.'))
+				mtime = module_mtime(module)
+				if cached is not None:
+					if cached[0] == mtime:
+						return dict(cached[1])
+					module = reload(module)	# it changed
+
 				result = getattr(module, attr)
 				# if this is a function, run it...
 				if type(result) is type(lambda: True):
@@ -281,9 +800,89 @@ def acquire_namespace(namespace, verbose=False):
 			print >> sys.stderr, _('the `namespace\' option must evaluate to a dictionary.')
 		return {}
 
+	if spec is not None:
+		_NAMESPACES[spec] = (mtime, namespace)
+		namespace = dict(namespace)	# callers may modify their copy
 	return namespace
 
 
+def benchmark_render(template, namespace={}, runs=20):
+	"""time rendering of a template with cold, disk and memory caches.
+	this returns a list of (cache, mean seconds per render) tuples."""
+	import time
+	import shutil
+	results = []
+	cachedir = tempfile.mkdtemp()
+	try:
+		for cache in ['cold', 'disk', 'warm']:
+			t = 0
+			for i in range(runs):
+				if cache != 'warm':
+					_COMPILED.clear()
+					_SOURCES.clear()
+				if cache == 'cold':
+					shutil.rmtree(cachedir)
+					os.mkdir(cachedir)
+				s = time.time()
+				manhelp(template, namespace, cachedir=cachedir)
+				t += time.time() - s
+			results.append((cache, t / runs))
+	finally:
+		shutil.rmtree(cachedir)
+	return results
+
+
+# the same sample page, as a Cheetah template and as a native page function
+SAMPLE_TEMPLATE = """$m.header('SAMPLE', 1, '2010-01-01', $version, 'User Manuals')
+$m.section('NAME')
+$m.name_description('sample', 'a sample page for benchmarks')
+$m.section('OPTIONS')
+#for $o in $options
+$m.option($o, $o[0], 'the ' + $o + ' option')
+#end for
+$m.section('SEE ALSO')
+$m.seealso([('man', 1), ('groff', 7)])
+"""
+
+def sample_page(doc, namespace):
+	"""build the sample page natively, to match SAMPLE_TEMPLATE."""
+	doc.header('SAMPLE', 1, '2010-01-01', namespace['version'], 'User Manuals')
+	doc.section('NAME')
+	doc.name_description('sample', 'a sample page for benchmarks')
+	doc.section('OPTIONS')
+	for o in namespace['options']:
+		doc.option(o, o[0], 'the ' + o + ' option')
+	doc.section('SEE ALSO')
+	doc.seealso([('man', 1), ('groff', 7)])
+
+
+def benchmark_backends(runs=200, imports=10):
+	"""time the import of each backend in a new process, and the mean
+	render time of the sample page with each backend. this returns a
+	list of (backend, import seconds, render seconds) tuples."""
+	import time
+	namespace = {'version': '1.0', 'options': ['alpha', 'beta', 'gamma']}
+	install(namespace, 'm')
+	directory = os.path.dirname(os.path.abspath(__file__))
+	code = 'import sys; sys.path.insert(0, %r); import manhelp' % directory
+	results = []
+	for (backend, extra, template) in [
+		('native', '', sample_page),
+		('cheetah', '; import Cheetah.Template', SAMPLE_TEMPLATE),
+	]:
+		t = time.time()
+		for i in range(imports):
+			subprocess.check_call([sys.executable, '-c', code + extra])
+		i = (time.time() - t) / imports
+
+		manhelp(template, namespace, cachedir=None)	# warm up
+		t = time.time()
+		for j in range(runs):
+			manhelp(template, namespace, cachedir=None)
+		results.append((backend, i, (time.time() - t) / runs))
+	return results
+
+
 def main(argv):
 	"""main function for running manhelp as a script utility."""
 	# NOTE: if you run this program as: `./manhelp.py -m', you get -m to
@@ -295,6 +894,10 @@ def main(argv):
 		print _('extra: ./%s -m template [namespace] (groff to man)' % b)
 		print _('extra: ./%s -z template [namespace] (write gz man)' % b)
 		print _('extra: ./%s -p template [namespace] (write ps man)' % b)
+		print _('extra: ./%s -b template [namespace] (benchmark it)' % b)
+		print _('extra: ./%s -B (benchmark the native and cheetah backends)' % b)
+		print _('extra: ./%s -f index name (whatis lookup in an index)' % b)
+		print _('extra: ./%s -k index keyword (apropos lookup in an index)' % b)
 		#print _('extra: ./%s template [namespace] | gzip -f > gzoutput.gz' % b)
 
 	if not os.name == 'posix':
@@ -306,11 +909,25 @@ def main(argv):
 	namespace = {}
 	b = os.path.basename(argv[0])
 	ps = False
+	benchmark = False
 	# TODO: in the future, when manhelp generates groff, we should add a gz
 	# option that takes the man section number and writes out the name.#.gz
 	# filename into the current directory. it makes sense to wait for groff
 	# generation so that we can get the name and section number dynamically
-	if len(argv) >= 3 and argv[1] in ['-m', '-z', '-p']:
+	if len(argv) == 4 and argv[1] in ['-f', '-k']:
+		lines = lookup_index(argv[2], argv[3], apropos=(argv[1] == '-k'))
+		for x in lines: print x
+		if not lines:
+			print >> sys.stderr, _('%s: nothing appropriate.' % argv[3])
+			sys.exit(1)
+		sys.exit()
+
+	if argv[1:] == ['-B']:
+		for (backend, i, r) in benchmark_backends():
+			print _('%s: %.1f ms import, %.3f ms per render' % (backend, i * 1000, r * 1000))
+		sys.exit()
+
+	if len(argv) >= 3 and argv[1] in ['-m', '-z', '-p', '-b']:
 		arg = argv.pop(1)
 		if arg == '-m':
 			# subprocess is pro magic. it's amazing that it works!
@@ -325,12 +942,19 @@ def main(argv):
 			sys.exit()
 		elif arg == '-p':
 			ps = True
+		elif arg == '-b':
+			benchmark = True
 
 	if len(argv) == 3:
 		namespace = acquire_namespace(argv[2], verbose=True)
 
 	if len(argv) in [2, 3]:
 		template = argv[1]
+		if benchmark:
+			for (cache, t) in benchmark_render(template, namespace):
+				print _('%s: %.2f ms per render' % (cache, t * 1000))
+			sys.exit()
+
 		obj = manhelp(template, namespace)
 		if ps: obj.topsfile()
 		else: obj.tostdout()
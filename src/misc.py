@@ -21,57 +21,103 @@ This is an assortment of small functions that don't belong anywhere important.
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 import glob
+import time
+import fnmatch
 _ = lambda x: x			# add fake gettext function until i fix up i18n
 __all__ = ('get_authors', 'get_license', 'get_version', 'get_home',
 	'get_capitalized_files',
+	'get_metadata',
 	'path_search',
 	'path_search_glob',
+	'path_search_many',
+	'PathIndex',
 )
 
 
+_METADATA = {}	# directory: metadata
+
+
+class metadata(object):
+	"""Project metadata, from the AUTHORS, COPYING and VERSION files.
+
+	Each file is only read when its attribute is first used, so the long
+	license is never read unless it is asked for, and the value is kept
+	until the mtime of the file changes. Use get_metadata to share one of
+	these for each directory, rather than making a new one.
+	"""
+	def __init__(self, wd):
+		self.wd = wd
+		self.cache = {}	# filename: (mtime, value)
+
+
+	def __read(self, filename, parse, default):
+		"""return parse(f) for the file, or default if it can't be read."""
+		path = os.path.join(self.wd, filename)
+		try:
+			mtime = os.stat(path).st_mtime
+		except OSError:
+			mtime = None
+		cached = self.cache.get(filename)
+		if cached is not None and cached[0] == mtime: return cached[1]
+
+		value = default
+		if mtime is not None:
+			try:
+				f = open(path, 'r')
+				try: value = parse(f)
+				finally: f.close()
+			except IOError:
+				pass
+		self.cache[filename] = (mtime, value)
+		return value
+
+
+	# assume it's an author if there is an email
+	authors = property(lambda self: list(self.__read('AUTHORS',
+		lambda f: [x.strip() for x in f if '@' in x], [])))
+	license = property(lambda self: self.__read('COPYING',
+		lambda f: f.read().strip(), None))
+	version = property(lambda self: self.__read('VERSION',
+		lambda f: f.read().strip(), '0.0'))
+
+
+	@property
+	def capitalized_files(self):
+		"""the files whose names are all capitalized, as of the last time
+		that the mtime of the directory changed."""
+		mtime = os.stat(self.wd).st_mtime
+		cached = self.cache.get(None)
+		if cached is None or cached[0] != mtime:
+			files = os.listdir(self.wd)
+			cached = (mtime, [x for x in files if x.isupper()])
+			self.cache[None] = cached
+		return list(cached[1])
+
+
+def get_metadata(wd=None):
+	"""Returns the shared metadata object for the directory."""
+	if wd is None: wd = os.getcwd()
+	wd = os.path.abspath(wd)
+	m = _METADATA.get(wd)
+	if m is None: m = _METADATA.setdefault(wd, metadata(wd))
+	return m
+
+
 def get_authors(wd=None):
 	"""Little function that pulls the authors from a text file."""
-	if wd is None: wd = os.getcwd()
-	try:
-		f = open(os.path.join(wd, 'AUTHORS'), 'r')
-		authors = f.readlines()
-		# assume it's an author if there is an email
-		return [x.strip() for x in authors if '@' in x]
-	except IOError:
-		return []
-	finally:
-		try: f.close()
-		except: pass
-		f = None
+	return get_metadata(wd).authors
 
 
 def get_license(wd=None):
 	"""Little function that pulls the license from a text file."""
-	if wd is None: wd = os.getcwd()
-	try:
-		f = open(os.path.join(wd, 'COPYING'), 'r')
-		return f.read().strip()
-	except IOError:
-		return None
-	finally:
-		try: f.close()
-		except: pass
-		f = None
+	return get_metadata(wd).license
 
 
 def get_version(wd=None):
 	"""Little function that pulls the version from a text file."""
-	if wd is None: wd = os.getcwd()
-	try:
-		f = open(os.path.join(wd, 'VERSION'), 'r')
-		return f.read().strip()
-	except IOError:
-		return '0.0'
-	finally:
-		try: f.close()
-		except: pass
-		f = None
+	return get_metadata(wd).version
 
 
 def get_home():
@@ -81,9 +127,7 @@ def get_home():
 
 def get_capitalized_files(wd=None):
 	"""Returns a list of files whose names are all capitalized."""
-	if wd is None: wd = os.getcwd()
-	files = os.listdir(wd)
-	return [filename for filename in files if filename.isupper()]
+	return get_metadata(wd).capitalized_files
 
 
 def path_search(filename, paths=[]):
@@ -109,6 +153,158 @@ def path_search_glob(fileglob, paths=[]):
 	return False
 
 
+def path_search_many(filenames, paths=[], every=False):
+	"""Return a dict of each filename to the first full path found for it
+	in the search array, or to False. Each directory is only listed once,
+	for all of the filenames together. If every is true, then each value is
+	a list of every full path found for that filename, in search order."""
+	# accepts either a list of paths, or a traditional path search string
+	if isinstance(paths, str): paths = paths.split(':')
+	found = dict([(x, []) for x in filenames])
+	pending = set([x for x in found if os.sep not in x])
+	nested = [x for x in found if os.sep in x]	# can't be in a listing
+	seen = set()
+	for path in [x for x in paths if x is not None]:
+		if path in seen: continue
+		seen.add(path)
+		if not pending and not nested: break
+		try:
+			names = pending.intersection(os.listdir(path or os.curdir))
+		except OSError:	# it's missing, or not a directory
+			names = set()
+		for name in list(names) + nested:
+			f = os.path.join(path, name)
+			if os.path.isfile(f):
+				found[name].append(f)
+		if not every:	# first match wins
+			pending.difference_update([x for x in names if found[x]])
+			nested = [x for x in nested if not found[x]]
+
+	if every: return found
+	return dict([(k, v and v[0] or False) for (k, v) in found.items()])
+
+
+class PathIndex(object):
+	"""Index the files in a search path, so that many lookups are cheap.
+
+	Each directory is listed once, and the files in it are merged into one
+	dict of name to full paths, in search order. A directory is only listed
+	again when its mtime changes, and the mtimes are checked at most every
+	interval seconds, so in between, each lookup is just a dict lookup. An
+	interval of zero checks the directories on every lookup. As in a PATH,
+	an empty path means the current directory.
+	"""
+	def __init__(self, paths=[], interval=1.0):
+		# accepts either a list of paths, or a traditional path search string
+		if isinstance(paths, str): paths = paths.split(':')
+		self.paths = []
+		for x in paths:	# a repeated path can't match anything new
+			if x is not None and x not in self.paths: self.paths.append(x)
+		self.interval = interval
+		self.checked = None	# when the mtimes were last checked
+		self.listings = {}	# path: (mtime, [names], [filenames])
+		self.index = {}		# filename: [full paths, in search order]
+		self.patterns = {}	# fileglob: compiled match function
+
+
+	def __listdir(self, path):
+		"""return the names of everything in path, and of the files in
+		path, like os.path.isfile would decide, as a tuple of lists."""
+		path = path or os.curdir
+		scandir = getattr(os, 'scandir', None)
+		if scandir is not None:	# python 3.5+ can skip most of the stats
+			entries = list(scandir(path))
+			return ([x.name for x in entries],
+				[x.name for x in entries if x.is_file()])
+		names = os.listdir(path)
+		return (names, [x for x in names
+			if os.path.isfile(os.path.join(path, x))])
+
+
+	def validate(self, force=False):
+		"""list any directories that changed, if it is time to check."""
+		now = time.time()
+		if not force and self.checked is not None and \
+		now - self.checked < self.interval:
+			return
+		self.checked = now
+		changed = False
+		for path in self.paths:
+			try:
+				mtime = os.stat(path or os.curdir).st_mtime
+			except OSError:	# it's missing
+				mtime = None
+			old = self.listings.get(path)
+			if old is not None and old[0] == mtime: continue
+			(names, files) = ([], [])
+			if mtime is not None:
+				try: (names, files) = self.__listdir(path)
+				except OSError: pass	# not a directory
+			self.listings[path] = (mtime, names, files)
+			changed = True
+
+		if changed:
+			index = {}
+			for path in self.paths:
+				for name in self.listings[path][2]:
+					index.setdefault(name, []).append(
+						os.path.join(path, name))
+			self.index = index
+
+
+	def search(self, filename):
+		"""Return the first full path to filename found in the index."""
+		if os.sep in filename: return path_search(filename, self.paths)
+		self.validate()
+		found = self.index.get(filename)
+		if not found: return False
+		return found[0]
+
+
+	def glob(self, fileglob):
+		"""Return the full paths matching fileglob in the first directory
+		of the index that has any, just like path_search_glob does. These
+		can be directories too, since glob matches any kind of name."""
+		if os.sep in fileglob: return path_search_glob(fileglob, self.paths)
+		self.validate()
+		match = self.patterns.get(fileglob)
+		if match is None:
+			match = re.compile(fnmatch.translate(fileglob)).match
+			self.patterns[fileglob] = match
+		hidden = fileglob.startswith('.')	# glob skips dot files
+		for path in self.paths:
+			found = [os.path.join(path, x) for x in self.listings[path][1]
+				if match(x) and (hidden or not x.startswith('.'))]
+			if found: return found
+		return False
+
+
+def benchmark_path_search(count=500, runs=5):
+	"""resolve count filenames, half of which exist, against $PATH in a
+	loop of path_search calls, with path_search_many and with a PathIndex,
+	and return a list of (method, seconds per run) tuples for each one."""
+	paths = os.getenv('PATH', '')
+	names = []
+	for path in paths.split(':'):
+		try: names.extend(os.listdir(path))
+		except OSError: pass
+	names = sorted(set(names))[:count/2]
+	names.extend(['missing-%d' % i for i in range(count - len(names))])
+	index = PathIndex(paths)
+	index.validate()	# a warm index, as a long running tool would have
+	methods = [
+		('loop', lambda: [path_search(x, paths) for x in names]),
+		('many', lambda: path_search_many(names, paths)),
+		('index', lambda: [index.search(x) for x in names]),
+	]
+	results = []
+	for (method, fn) in methods:
+		t = time.time()
+		for i in range(runs): fn()
+		results.append((method, (time.time() - t) / runs))
+	return results
+
+
 if __name__ == '__main__':
 	# command line argument parsing
 	import optparse
@@ -118,9 +314,16 @@ if __name__ == '__main__':
 	parser.add_option('-x', '--execute', dest='execute', choices=__all__,
 		metavar=_('<function>'), help=_('execute this function')
 	)
+	parser.add_option('-b', '--benchmark', dest='benchmark',
+		choices=['path_search'], metavar=_('<name>'),
+		help=_('run this benchmark')
+	)
 	(options, args) = parser.parse_args()
 
-	if options.execute:
+	if options.benchmark == 'path_search':
+		for (method, seconds) in benchmark_path_search():
+			print '%6s: %8.3f ms' % (method, seconds * 1000)
+	elif options.execute:
 		print eval(options.execute)(*args)
 	else:
 		parser.error(_('No function specified.'))
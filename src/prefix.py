@@ -26,58 +26,75 @@ Example: x=`./prefix.py`; echo 'prefix: '$x
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-__all__ = ('prefix', 'name')
+__all__ = ('prefix', 'name', 'join_many')
 #DEBUG = False
 
 import os
 import sys
 
+# the python version directories that site-packages can be found inside of,
+# for example: python2.6, python3.12, python3.13t, or python3 (on debian).
+VERSIONS = [
+	'python%d.%d' % sys.version_info[:2],
+	'python%d.%d%s' % (sys.version_info[:2] + (getattr(sys, 'abiflags', ''),)),
+	'python%d' % sys.version_info[0],
+]
+_CACHE = {}	# this is all computed once per process, since it can't change
+
+
+def _resolve(path):
+	"""Returns the prefix matching the installed layout of path or False."""
+	# to match: /usr/lib/python2.5/site-packages/project/prefix.py
+	# or: /usr/local/lib/python2.6/dist-packages/project/prefix.py
+	# or: /usr/lib64/python3.12/site-packages/project/prefix.py
+	# or: ~/.local/lib/python3.10/site-packages/project/prefix.py (--user)
+	# or: <venv>/lib/python3.11/site-packages/project/prefix.py (a venv)
+	# or: C:\Python27\Lib\site-packages\project\prefix.py (windows)
+	path = os.path.dirname(os.path.dirname(path))	# 'project/prefix.py'
+	#if DEBUG: print 'path: %s' % path
+	(path, token) = os.path.split(path)
+	if token not in ['site-packages', 'dist-packages']: return False
+	(path, token) = os.path.split(path)
+	if os.name == 'nt' and token.lower() == 'lib': return path
+	if token not in VERSIONS: return False
+	(path, token) = os.path.split(path)
+	if token not in ['lib', 'lib64']: return False
+	# usually returns: /usr/ or /usr/local/ (but without slash postfix)
+	return path
+
 
 def prefix(join=None):
 	"""Returns the prefix that this code was installed into."""
-	# constants for this execution
-	path = os.path.abspath(__file__)
-	#if DEBUG: print 'path: %s' % path
-	name = os.path.basename(os.path.dirname(path))
-	#if DEBUG: print 'name: %s' % name
-	this = os.path.basename(path)
-	#if DEBUG: print 'this: %s' % this
-
-	# rule set
-	rules = [
-		# to match: /usr/lib/python2.5/site-packages/project/prefix.py
-		# or: /usr/local/lib/python2.6/dist-packages/project/prefix.py
-		lambda x: x == 'lib',
-		lambda x: x == ('python%s' % sys.version[:3]),
-		lambda x: x in ['site-packages', 'dist-packages'],
-		lambda x: x == name,	# 'project'
-		lambda x: x == this,	# 'prefix.py'
-	]
-
-	# matching engine
-	while len(rules) > 0:
-		(path, token) = os.path.split(path)
-		#if DEBUG: print 'path: %s, token: %s' % (path, token)
-		rule = rules.pop()
-		if not rule(token):
-			#if DEBUG: print 'rule failed'
-			return False
+	path = _CACHE.get('prefix')
+	if path is None:
+		path = _CACHE['prefix'] = _resolve(os.path.abspath(__file__))
 
-	# usually returns: /usr/ or /usr/local/ (but without slash postfix)
-	if join is None:
+	if not path or join is None:
 		return path
 	else:
 		return os.path.join(path, join)	# add on join if it exists!
 
 
+def join_many(joins):
+	"""Returns a list of each path in joins, joined onto the prefix. This
+	returns False when not installed, just like the prefix function."""
+	path = prefix()
+	if not path: return False
+	return [os.path.join(path, x) for x in joins]
+
+
 def name(pop=[], suffix=None):
 	"""Returns the name of this particular project. If pop is a list
 	containing more than one element, name() will remove those items
 	from the path tail before deciding on the project name. If there
 	is an element which does not exist in the path tail, then raise.
 	If a suffix is specified, then it is removed if found at end."""
-	path = os.path.dirname(os.path.abspath(__file__))
 	if isinstance(pop, str): pop = [pop]	# force single strings to list
+	key = ('name', tuple(pop), suffix)
+	if key in _CACHE: return _CACHE[key]
+
+	path = os.path.dirname(os.path.abspath(__file__))
+	pop = list(pop)	# don't eat the callers list
 	while len(pop) > 0:
 		(path, tail) = os.path.split(path)
 		if pop.pop() != tail:
@@ -87,6 +104,7 @@ def name(pop=[], suffix=None):
 	path = os.path.basename(path)
 	if suffix is not None and path.endswith(suffix):
 		path = path[0:-len(suffix)]
+	_CACHE[key] = path
 	return path
 
 
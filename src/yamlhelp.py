@@ -24,32 +24,259 @@ library.
 
 import yaml
 import os	# for os.linesep
+import stat
+import time
+import errno
+import select
+import struct
+import hashlib
+import cPickle
+import tempfile
+import threading
+import collections
+
+# use the libyaml bindings when they are available, since they are a lot faster
+# than the pure python implementation. the safe versions are used by default,
+# because the full loader can construct arbitrary python objects from a file.
+SAFE_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SAFE_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+UNSAFE_LOADER = getattr(yaml, 'CLoader', yaml.Loader)
+UNSAFE_DUMPER = getattr(yaml, 'CDumper', yaml.Dumper)
+
+# a process wide cache of parsed files, keyed by (absolute path, loader, tabs,
+# indent), with the (mtime, size, inode) that each was parsed at, so that a
+# single stat call tells if it is still valid. it is an lru, bounded in entries and file bytes.
+CACHE_MAXENTRIES = 128
+CACHE_MAXBYTES = 64*1024*1024
+_CACHE = collections.OrderedDict()	# key: (signature, size, data)
+_CACHE_LOCK = threading.Lock()
+_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+# inotify constants from <sys/inotify.h>. the directory is watched rather than
+# the file, because editors often save by renaming a new file over the old one.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 02000000
+IN_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+	IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct('iIII')	# wd, mask, cookie, len
+
+
+def _readonly(self, *args, **kwargs):
+	raise TypeError('Cached yaml data is read only, thaw() it for a copy.')
+
+
+class frozendict(dict):
+	"""A dict which can't be modified, used for cached yaml data."""
+	__setitem__ = __delitem__ = _readonly
+	clear = pop = popitem = setdefault = update = _readonly
+
+	def __reduce__(self):
+		return (frozendict, (dict(self),))
+
+
+class frozenlist(list):
+	"""A list which can't be modified, used for cached yaml data."""
+	__setitem__ = __delitem__ = __setslice__ = __delslice__ = _readonly
+	__iadd__ = __imul__ = _readonly
+	append = extend = insert = pop = remove = reverse = sort = _readonly
+
+	def __reduce__(self):
+		return (frozenlist, (list(self),))
+
+
+def freeze(data):
+	"""return a read only version of the data, recursively."""
+	if isinstance(data, dict):
+		return frozendict([(freeze(k), freeze(v)) for (k, v) in data.items()])
+	elif isinstance(data, list):
+		return frozenlist([freeze(x) for x in data])
+	elif isinstance(data, set):
+		return frozenset(data)
+	return data
+
+
+def thaw(data):
+	"""return a modifiable copy of frozen data, recursively."""
+	if isinstance(data, dict):
+		return dict([(thaw(k), thaw(v)) for (k, v) in data.items()])
+	elif isinstance(data, list):
+		return [thaw(x) for x in data]
+	elif isinstance(data, frozenset):
+		return set(data)
+	return data
+
+
+# frozen data dumps just like the plain types, rather than as python objects
+for x in [SAFE_DUMPER, UNSAFE_DUMPER]:
+	yaml.add_representer(frozendict,
+		yaml.representer.SafeRepresenter.represent_dict, Dumper=x)
+	yaml.add_representer(frozenlist,
+		yaml.representer.SafeRepresenter.represent_list, Dumper=x)
+	yaml.add_representer(frozenset,
+		yaml.representer.SafeRepresenter.represent_set, Dumper=x)
+del x
+
+
+def cache_info():
+	"""return a dict of the hits, misses, evictions, entries and bytes."""
+	_CACHE_LOCK.acquire()
+	try:
+		info = dict(_CACHE_STATS)
+		info['entries'] = len(_CACHE)
+		return info
+	finally:
+		_CACHE_LOCK.release()
+
+
+def cache_clear():
+	"""empty the cache of parsed files, and reset its counters."""
+	_CACHE_LOCK.acquire()
+	try:
+		_CACHE.clear()
+		for key in _CACHE_STATS.keys(): _CACHE_STATS[key] = 0
+	finally:
+		_CACHE_LOCK.release()
+
+
+def detab(line, width=2):
+	"""expand each leading tab of the line into width spaces."""
+	n = len(line) - len(line.lstrip('\t'))
+	if n == 0: return line
+	return ' ' * (n * width) + line[n:]
+
+
+def entab(line, width=2):
+	"""replace each whole width of leading spaces of the line with a tab.
+	any spaces left over are kept after the tabs, and a line which has a
+	tab inside its leading whitespace is left alone, so that for any line
+	which doesn't start with a tab, detab(entab(line)) == line exactly."""
+	stripped = line.lstrip(' ')
+	n = len(line) - len(stripped)
+	if n < width or stripped[:1] == '\t': return line
+	return '\t' * (n / width) + ' ' * (n % width) + stripped
+
+
+class _DetabReader(object):
+	"""file like object which expands leading tabs as it is read."""
+	def __init__(self, f, width=2):
+		self.f = f
+		self.width = width
+		self.buffer = ''
+
+	def read(self, size=-1):
+		chunks = [self.buffer]
+		length = len(self.buffer)
+		while size < 0 or length < size:
+			line = self.f.readline()
+			if not line: break
+			line = detab(line, self.width)
+			chunks.append(line)
+			length += len(line)
+		data = ''.join(chunks)
+		if size < 0: size = length
+		self.buffer = data[size:]
+		return data[:size]
+
+
+class _HashingWriter(object):
+	"""file like object that hashes everything written through it. the
+	emitter writes many tiny chunks, so they're batched up before use.
+	if a filter is given, it is run on each batch of whole lines."""
+	def __init__(self, f, size=64*1024, filter=None):
+		self.f = f
+		self.mode = f.mode
+		self.size = size
+		self.filter = filter
+		self.buffer = []
+		self.length = 0
+		self.sha1 = hashlib.sha1()
+
+	def write(self, data):
+		if isinstance(data, unicode): data = data.encode('utf-8')
+		self.buffer.append(data)
+		self.length += len(data)
+		if self.length >= self.size: self.flush()
+
+	def flush(self, final=False):
+		data = ''.join(self.buffer)
+		self.buffer = []
+		self.length = 0
+		if self.filter is not None:
+			if not final:	# only whole lines can be filtered
+				i = data.rfind('\n') + 1
+				if i < len(data):
+					self.buffer = [data[i:]]
+					self.length = len(data) - i
+				data = data[:i]
+			data = self.filter(data)
+		self.sha1.update(data)
+		self.f.write(data)
+
+	def hexdigest(self):
+		return self.sha1.hexdigest()
+
 
 # TODO: rewrite yamlhelp class to provide useful one liner functions to call.
 class yamlhelp:
 
-	def __init__(self, filename):
+	def __init__(self, filename, safe=True, snapshot=None, tabs=False, indent=2):
+		"""if safe is false, then the full yaml loader and dumper are
+		used, which support python objects, so only use trusted files.
+		if snapshot is `file' or `cache', then a pickled snapshot of the
+		data is kept next to the file or in the xdg cache, and is loaded
+		instead of parsing the yaml, for as long as the sha1 of the file
+		still matches. snapshots that aren't owned by us, or which other
+		users can write to, are never loaded, since they are pickles.
+		if tabs is true, then the file is kept nicely tabbed, with each
+		level of indent spaces in the yaml replaced by a leading tab."""
 		# TODO: should we use: os.path.abspath ?
 		self.filename = filename
-
-
-	def get_yaml(self):
-		"""load data from a yaml file"""
+		self.safe = safe
+		if snapshot not in [None, 'file', 'cache']:
+			raise ValueError('Snapshot must be None, file or cache.')
+		self.snapshot = snapshot
+		self.tabs = tabs
+		self.indent = indent
+		if self.safe:
+			(self.loader, self.dumper) = (SAFE_LOADER, SAFE_DUMPER)
+		else:
+			(self.loader, self.dumper) = (UNSAFE_LOADER, UNSAFE_DUMPER)
+
+
+	def get_yaml(self, cached=False):
+		"""load data from a yaml file. if cached is true, then the data
+		is only parsed again if the file changed, and it is read only."""
+		if cached: return self.__get_cached()
 
 		data = None
 		try:
 			f = None
 			f = open(self.filename, 'r')
 			text = f.read()	# read it all
-			#text = self.tabs2spaces(text)
+
+			if self.snapshot is not None:
+				digest = hashlib.sha1(text).hexdigest()
+				(found, data) = self.__load_snapshot(digest)
+				if found: return data
+
+			if self.tabs: text = self.tabs2spaces(text)
 
 			try:
-				data = yaml.load(text)
+				data = yaml.load(text, Loader=self.loader)
 
-			except yaml.scanner.ScannerError, e:
+			except yaml.YAMLError, e:
 				#return None
 				raise SyntaxError("yaml error: `%s', with: `%s'" % (str(e), self.filename))
 
+			if self.snapshot is not None:
+				self.__save_snapshot(digest, data)
+
 		except IOError, e:
 			raise IOError(e)
 			#pass
@@ -63,25 +290,250 @@ class yamlhelp:
 		return data
 
 
-	def put_yaml(self, data, mode='w+'):
-		"""dump data into a yaml file"""
+	def __get_cached(self):
+		"""load data from the process wide cache, or into it."""
+		path = os.path.abspath(self.filename)
+		try:
+			st = os.stat(path)
+		except OSError, e:
+			raise IOError(e)
+		signature = (st.st_mtime, st.st_size, st.st_ino)
+		key = (path, self.loader, self.tabs, self.indent)
 
+		_CACHE_LOCK.acquire()
+		try:
+			entry = _CACHE.pop(key, None)
+			if entry is not None:
+				if entry[0] == signature:
+					_CACHE[key] = entry	# most recently used
+					_CACHE_STATS['hits'] += 1
+					return entry[2]
+				_CACHE_STATS['bytes'] -= entry[1]
+			_CACHE_STATS['misses'] += 1
+		finally:
+			_CACHE_LOCK.release()
+
+		# if the file changes after the stat, the next stat will differ
+		data = freeze(self.get_yaml())
+
+		_CACHE_LOCK.acquire()
+		try:
+			old = _CACHE.pop(key, None)	# from a racing thread
+			if old is not None: _CACHE_STATS['bytes'] -= old[1]
+			_CACHE[key] = (signature, st.st_size, data)
+			_CACHE_STATS['bytes'] += st.st_size
+			while len(_CACHE) > 1 and \
+			(len(_CACHE) > CACHE_MAXENTRIES or
+			_CACHE_STATS['bytes'] > CACHE_MAXBYTES):
+				(k, old) = _CACHE.popitem(last=False)
+				_CACHE_STATS['bytes'] -= old[1]
+				_CACHE_STATS['evictions'] += 1
+		finally:
+			_CACHE_LOCK.release()
+		return data
+
+
+	def snapshot_path(self):
+		"""return the filename of the snapshot for this file."""
+		path = os.path.abspath(self.filename)
+		if self.snapshot == 'file':
+			(head, tail) = os.path.split(path)
+			return os.path.join(head, '.%s.pickle' % tail)
+		import xdg.BaseDirectory	# only import if needed
+		return os.path.join(xdg.BaseDirectory.xdg_cache_home,
+			os.path.splitext(os.path.basename(__file__))[0],
+			'%s.pickle' % hashlib.sha1(path).hexdigest())
+
+
+	def __load_snapshot(self, digest):
+		"""return (True, data) from a valid snapshot, or (False, None)."""
+		try:
+			f = open(self.snapshot_path(), 'rb')
+		except IOError:
+			return (False, None)
 		try:
-			f = None
-			f = open(self.filename, mode)	# overwrite is default
 			try:
-				text = yaml.dump(data)
+				st = os.fstat(f.fileno())
+				if st.st_uid != os.getuid() or \
+				st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+					return (False, None)	# not trusted
+				tag = (digest, self.safe, self.tabs, self.indent)
+				if cPickle.load(f) != tag:
+					return (False, None)	# out of date
+				return (True, cPickle.load(f))
+			except Exception:
+				return (False, None)	# corrupt
+		finally:
+			f.close()
 
-			except yaml.scanner.ScannerError, e:
-				#return None
+
+	def __save_snapshot(self, digest, data):
+		"""atomically write a snapshot of the data, if we can."""
+		filename = self.snapshot_path()
+		dirname = os.path.dirname(filename)
+		try:
+			try:
+				os.makedirs(dirname)
+			except OSError, e:
+				if e.errno != errno.EEXIST: raise
+			(fd, temp) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+			f = os.fdopen(fd, 'wb')
+			try:
+				tag = (digest, self.safe, self.tabs, self.indent)
+				cPickle.dump(tag, f, 2)
+				cPickle.dump(data, f, 2)
+			finally:
+				f.close()
+			os.rename(temp, filename)
+		except (IOError, OSError, cPickle.PicklingError):
+			try: os.unlink(temp)
+			except: pass
+
+
+	def watch(self, callback=None, interval=1.0, debounce=0.1, inotify=True):
+		"""start and return a watcher for this file. see: watcher."""
+		w = watcher(self, interval=interval, debounce=debounce,
+			inotify=inotify)
+		if callback is not None: w.subscribe(callback)
+		w.start()
+		return w
+
+
+	def get_yaml_all(self):
+		"""load each document from a multi document yaml file, one at a
+		time, without reading the whole file into memory first."""
+		f = open(self.filename, 'r')
+		try:
+			try:
+				stream = f
+				if self.tabs: stream = _DetabReader(f, self.indent)
+				for data in yaml.load_all(stream, Loader=self.loader):
+					yield data
+
+			except yaml.YAMLError, e:
 				raise SyntaxError("yaml error: `%s', with: `%s'" % (str(e), self.filename))
 
-			#text = self.spaces2tabs(text)
+		finally:
+			f.close()
 
 
-			f.writelines(text)
+	def iter_yaml(self):
+		"""lazily walk the top level of the first document of the file.
+		a sequence yields each item, and a mapping yields each (key,
+		value) pair, which are composed one at a time from the parser
+		events, so that only a single item is ever in memory at once.
+		any other document is yielded whole."""
+		f = open(self.filename, 'r')
+		try:
+			stream = f
+			if self.tabs: stream = _DetabReader(f, self.indent)
+			# the libyaml loaders can't compose one node at a time
+			if self.safe: loader = yaml.SafeLoader(stream)
+			else: loader = yaml.Loader(stream)
+			try:
+				loader.get_event()	# StreamStartEvent
+				if loader.check_event(yaml.StreamEndEvent): return
+				loader.get_event()	# DocumentStartEvent
 
-		except IOError, e:
+				if loader.check_event(yaml.SequenceStartEvent):
+					loader.get_event()
+					while not loader.check_event(yaml.SequenceEndEvent):
+						yield self.__construct(loader)
+
+				elif loader.check_event(yaml.MappingStartEvent):
+					loader.get_event()
+					while not loader.check_event(yaml.MappingEndEvent):
+						key = self.__construct(loader)
+						yield (key, self.__construct(loader))
+
+				else:
+					yield self.__construct(loader)
+
+			except yaml.YAMLError, e:
+				raise SyntaxError("yaml error: `%s', with: `%s'" % (str(e), self.filename))
+
+			finally:
+				loader.dispose()
+		finally:
+			f.close()
+
+
+	def __construct(self, loader):
+		"""compose and construct the next node from the loader."""
+		node = loader.compose_node(None, None)
+		return loader.construct_document(node)
+
+
+	def put_yaml(self, data, mode='w+', fsync=None):
+		"""dump data into a yaml file. when overwriting (the default), the
+		dump is streamed into a temporary file in the same directory and
+		then renamed over the target, so a crash never leaves a truncated
+		file behind. fsync can be None, `file' to flush the file data to
+		disk before the rename, or `full' to also sync the directory so
+		that the rename itself survives a power loss."""
+		if fsync not in [None, 'file', 'full']:
+			raise ValueError('Fsync must be None, file or full.')
+
+		if 'a' in mode:	# appending can't be done atomically
+			return self.__dump_yaml(data, open(self.filename, mode))
+
+		# replace the target of a symlink, and not the link itself
+		filename = os.path.realpath(self.filename)
+		dirname = os.path.dirname(filename)
+		try:
+			(fd, temp) = tempfile.mkstemp(dir=dirname,
+				prefix='.%s.' % os.path.basename(filename), suffix='.tmp')
+		except OSError, e:
+			raise IOError(e)
+
+		try:
+			try:	# keep the permissions of the file we replace
+				st = os.stat(filename)
+				try:
+					os.fchown(fd, st.st_uid, st.st_gid)
+				except OSError:	# only root can give files away
+					pass
+				os.fchmod(fd, stat.S_IMODE(st.st_mode))
+			except OSError:
+				umask = os.umask(0)
+				os.umask(umask)
+				os.fchmod(fd, 0666 & ~umask)
+
+			self.__dump_yaml(data, os.fdopen(fd, 'w'), fsync=fsync)
+			os.rename(temp, filename)	# atomic on posix
+			if fsync == 'full':
+				dfd = os.open(dirname, os.O_RDONLY)
+				try: os.fsync(dfd)
+				finally: os.close(dfd)
+
+		except:
+			try: os.unlink(temp)
+			except OSError: pass
+			raise
+
+		return None
+
+
+	def __dump_yaml(self, data, f, fsync=None):
+		"""stream the yaml dump of data into the open file f, and close
+		it. the dump is hashed on the way past to refresh the snapshot."""
+		try:
+			stream = _HashingWriter(f,
+				filter=self.tabs and self.spaces2tabs or None)
+			try:
+				yaml.dump(data, stream, Dumper=self.dumper,
+					indent=self.indent)
+
+			except yaml.YAMLError, e:
+				#return None
+				raise SyntaxError("yaml error: `%s', with: `%s'" % (str(e), self.filename))
+
+			stream.flush(final=True)
+			f.flush()
+			if fsync is not None:
+				os.fsync(f.fileno())
+
+		except (IOError, OSError), e:
 			raise IOError(e)
 			#pass
 
@@ -90,58 +542,302 @@ class yamlhelp:
 			except: pass
 			f = None
 
+		if self.snapshot is not None and 'a' not in stream.mode:
+			self.__save_snapshot(stream.hexdigest(), data)
+
 		return None
 
 
 	def tabs2spaces(self, text):
 		"""this converts a nicely tabbed version into yaml load input."""
-		return text.replace('\t', ' '*8)
+		return ''.join([detab(x, self.indent) for x in text.splitlines(True)])
 
 
 	def spaces2tabs(self, text):
 		"""this converts yaml dump output into a nicely tabbed version."""
+		return ''.join([entab(x, self.indent) for x in text.splitlines(True)])
 
-		# TODO: this version of the function doesn't work properly!
-		# it needs to be fixed-- it leaves extra spaces. see below.
-
-		text = text.splitlines()	# make an array of the lines
-		for i in range(len(text)):		# for each line...
-
-			c = text[i].count('  ')	# how many pairs of spaces are there.
-			# remove all except the last two, because those are probably the `  ' under a: `- ' for a list.
-			text[i] = text[i].replace('  ', '\t', c-1)
-
-		text = map(lambda x: x+os.linesep, text)	# add a newline onto the end of each line
-		return ''.join(text)
 
-		# TODO: make this function. i had a simple version but it doesn't work properly.
-		# what is below is excerpts from the trials and is a mess of partially finished-ness
-
-		### uhh append keep levels as we descend into deeper hierarchy in the text, and remove and use as we ascend back up?
-		"""
-		keep = []			# number of pairs of spaces to not replace away
-		keep.append(0)
-		text = text.splitlines()	# make an array of the lines
-		for i in range(len(text)):		# for each line...
-			lstrip = text[i].lstrip()	# strip off leading whitespace
-			wc = len(text[i]) - len(lstrip)	# how many whitespace chars were removed
-
-			c = text[i].count('  ')	# how many pairs of spaces are there.
-			# remove all except the last two, because those are probably the `  ' under a: `- ' for a list.
-			text[i] = text[i].replace('  ', '\t', c-1)
-
-			# for the child
-			if lstrip[0:2] == '- ':
-				keep = 1
-
-			if different len:
-				keep = 0
-
-		text = map(lambda x: x+os.linesep, text)	# add a newline onto the end of each line
-		"""
+def _inotify_init(dirname):
+	"""return an inotify fd watching dirname, or None if we can't."""
+	try:
+		import ctypes
+		libc = ctypes.CDLL(None, use_errno=True)	# libc is already loaded
+		fd = libc.inotify_init1(IN_CLOEXEC)
+	except (OSError, AttributeError):	# not linux
+		return None
+	if fd < 0: return None
+	if libc.inotify_add_watch(fd, dirname, IN_MASK) < 0:
+		os.close(fd)
+		return None
+	return fd
+
+
+class watcher(threading.Thread):
+	"""Watch a yaml file and reload it in the background when it changes.
+
+	The file is watched with inotify on linux, and with stat polling every
+	interval seconds otherwise. A burst of changes, such as an editor doing
+	a truncate and write or a rename over the file, is debounced into one
+	reload once the file has been quiet for debounce seconds. Subscribers
+	are only called when the new version parses, and the latest data is in
+	the data attribute, which is just read, and so never blocks on a lock.
+	"""
+	def __init__(self, helper, interval=1.0, debounce=0.1, inotify=True):
+		threading.Thread.__init__(self, name='watcher')
+		self.daemon = True
+		self.helper = helper
+		self.filename = os.path.abspath(helper.filename)
+		self.interval = interval
+		self.debounce = debounce
+		self.subscribers = []
+		self.lock = threading.Lock()	# only for the subscribers list
+		(self.rpipe, self.wpipe) = os.pipe()	# wakes us up to stop
+		self.stopped = False
+		self.error = None	# the last parse error, if any
+		self.data = None
+		# start watching before the first load, so no change is missed
+		self.fd = None
+		if inotify: self.fd = _inotify_init(os.path.dirname(self.filename))
+		self.last = self.__signature()
+		self.reload(publish=False)
+
+
+	def subscribe(self, callback):
+		"""call callback(data) with each new successfully parsed version."""
+		with self.lock:
+			self.subscribers = self.subscribers + [callback]
+
+
+	def unsubscribe(self, callback):
+		with self.lock:
+			self.subscribers = [x for x in self.subscribers if x != callback]
+
+
+	def stop(self):
+		"""stop watching, and wait for the thread to finish. stopping
+		again does nothing."""
+		if self.wpipe is None: return	# already stopped
+		self.stopped = True
+		os.write(self.wpipe, 'x')
+		if self.is_alive(): self.join()
+		os.close(self.rpipe)
+		os.close(self.wpipe)
+		(self.rpipe, self.wpipe) = (None, None)
+		if self.fd is not None: os.close(self.fd)
+		self.fd = None
+
+
+	def reload(self, publish=True):
+		"""parse the file, and if it worked, publish the new data."""
+		try:
+			data = self.helper.get_yaml()
+		except (IOError, OSError, SyntaxError), e:
+			self.error = e
+			return False
+
+		self.error = None
+		if data == self.data and publish: return True	# no real change
+		self.data = data	# an atomic swap, for lock free readers
+		if not publish: return True
+		for callback in self.subscribers:	# a copy on write list
+			try:
+				callback(data)
+			except Exception:
+				pass	# one bad subscriber shouldn't stop the others
+		return True
+
+
+	def __wait(self, fds, timeout):
+		"""wait for one of fds to be readable, or return [] on timeout."""
+		r = select.select([self.rpipe] + fds, [], [], timeout)[0]
+		if self.rpipe in r: self.stopped = True
+		return [x for x in r if x != self.rpipe]
+
+
+	def __events(self, fd):
+		"""read pending inotify events, and return true if any were for us."""
+		buf = os.read(fd, 65536)
+		name = os.path.basename(self.filename)
+		found = False
+		i = 0
+		while i + INOTIFY_EVENT.size <= len(buf):
+			(wd, mask, cookie, length) = INOTIFY_EVENT.unpack_from(buf, i)
+			i += INOTIFY_EVENT.size
+			if mask & IN_Q_OVERFLOW or \
+			buf[i:i+length].rstrip('\0') == name:
+				found = True
+			i += length
+		return found
+
+
+	def __signature(self):
+		try:
+			st = os.stat(self.filename)
+		except OSError:
+			return None
+		return (st.st_mtime, st.st_size, st.st_ino)
+
+
+	def run(self):
+		if self.fd is None:
+			self.__poll()
+		else:
+			self.__notify(self.fd)
+
+
+	def __notify(self, fd):
+		while not self.stopped:
+			if not self.__wait([fd], None): continue
+			if not self.__events(fd): continue
+			while self.__wait([fd], self.debounce):	# debounce
+				self.__events(fd)
+			if not self.stopped: self.reload()
+
+
+	def __poll(self):
+		last = self.last
+		while not self.stopped:
+			self.__wait([], self.interval)
+			signature = self.__signature()
+			if signature == last: continue
+			while not self.stopped:	# debounce
+				self.__wait([], self.debounce)
+				last = signature
+				signature = self.__signature()
+				if signature == last: break
+			if not self.stopped: self.reload()
+
+
+def benchmark_memory(items=50000):
+	"""write a large yaml fixture with a top level sequence of items, and
+	measure the peak memory used when loading it with each method, each
+	in a new process. this returns a list of (method, peak kB) tuples."""
+	import sys
+	import tempfile
+	import subprocess
+	(fd, filename) = tempfile.mkstemp(suffix='.yaml')
+	f = os.fdopen(fd, 'w')
+	try:
+		for i in xrange(items):
+			f.write('- {id: %d, name: item%d, tags: [a, b, c]}\n' % (i, i))
+	finally:
+		f.close()
+
+	directory = os.path.dirname(os.path.abspath(__file__))
+	code = 'import sys, resource\nsys.path.insert(0, %r)\n' \
+	'import yamlhelp\ny = yamlhelp.yamlhelp(%r)\n%s\n' \
+	'print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n'
+	methods = [
+		('baseline', 'pass'),
+		('get_yaml', 'x = y.get_yaml()'),
+		('get_yaml_all', 'for x in y.get_yaml_all(): pass'),
+		('iter_yaml', 'for x in y.iter_yaml(): pass'),
+	]
+	results = []
+	try:
+		for (method, statement) in methods:
+			cmd = [sys.executable, '-c',
+				code % (directory, filename, statement)]
+			out = subprocess.Popen(cmd,
+				stdout=subprocess.PIPE).communicate()[0]
+			results.append((method, int(out.strip())))
+	finally:
+		os.unlink(filename)
+	return results
+
+
+def benchmark_throughput(items=5000, runs=3):
+	"""write a representative config style yaml fixture and measure load
+	and dump throughput, with the libyaml bindings and in pure python. a
+	list of (loader or dumper, operation, MB per second) is returned."""
+	import time
+	import tempfile
+	data = {'hosts': dict([('host%d.example.com' % i, {
+		'address': '10.0.%d.%d' % (i / 256, i % 256),
+		'roles': ['web', 'db', 'cache'][:(i % 3) + 1],
+		'enabled': i % 2 == 0,
+		'weight': i * 0.5,
+		'tags': {'rack': 'r%d' % (i % 40), 'zone': 'z%d' % (i % 4)},
+	}) for i in xrange(items)])}
+	(fd, filename) = tempfile.mkstemp(suffix='.yaml')
+	os.close(fd)
+	pairs = [('libyaml', getattr(yaml, 'CSafeLoader', None),
+		getattr(yaml, 'CSafeDumper', None)),
+		('python', yaml.SafeLoader, yaml.SafeDumper)]
+	results = []
+	try:
+		y = yamlhelp(filename)
+		y.put_yaml(data)
+		size = os.path.getsize(filename) / 1048576.0
+		for (name, loader, dumper) in pairs:
+			if loader is None: continue	# no libyaml bindings
+			(y.loader, y.dumper) = (loader, dumper)
+			t = time.time()
+			for i in range(runs): y.get_yaml()
+			results.append((name, 'load', size * runs / (time.time() - t)))
+			t = time.time()
+			for i in range(runs): y.put_yaml(data)
+			results.append((name, 'dump', size * runs / (time.time() - t)))
+	finally:
+		os.unlink(filename)
+	return results
+
+
+def benchmark_write(sizes=(1, 100)):
+	"""measure the write throughput of put_yaml for data that dumps to
+	roughly each size in MB, against the old dump to a string approach,
+	and with each fsync policy. a list of (MB, method, MB per second) is
+	returned. the sizes are approximate, so the real size is measured."""
+	import time
+	import tempfile
+	(fd, filename) = tempfile.mkstemp(suffix='.yaml')
+	os.close(fd)
+	results = []
+	try:
+		y = yamlhelp(filename)
+		for mb in sizes:
+			data = ['%06d %s' % (i, 'x' * 1000) for i in xrange(mb * 1024)]
+			def string():
+				f = open(filename, 'w+')
+				try: f.write(yaml.dump(data, Dumper=y.dumper))
+				finally: f.close()
+			methods = [
+				('string', string),
+				('atomic', lambda: y.put_yaml(data)),
+				('fsync=file', lambda: y.put_yaml(data, fsync='file')),
+				('fsync=full', lambda: y.put_yaml(data, fsync='full')),
+			]
+			for (method, fn) in methods:
+				t = time.time()
+				fn()
+				t = time.time() - t
+				size = os.path.getsize(filename) / 1048576.0
+				results.append((mb, method, size / t))
+	finally:
+		os.unlink(filename)
+	return results
 
 
 if __name__ == '__main__':
-	# TODO: run some yaml code here.
-	print 'TODO: run some yaml code.'
+	import optparse
+	parser = optparse.OptionParser()
+	parser.add_option('-b', '--benchmark', dest='benchmark',
+		choices=['memory', 'throughput', 'write'], metavar='<name>',
+		help='run this benchmark'
+	)
+	(options, args) = parser.parse_args()
+
+	if options.benchmark == 'memory':
+		for (method, peak) in benchmark_memory():
+			print '%12s: %8d kB peak' % (method, peak)
+	elif options.benchmark == 'throughput':
+		for (name, operation, rate) in benchmark_throughput():
+			print '%8s %s: %7.2f MB/s' % (name, operation, rate)
+	elif options.benchmark == 'write':
+		for (mb, method, rate) in benchmark_write():
+			print '%4d MB %10s: %7.2f MB/s' % (mb, method, rate)
+	else:
+		# TODO: run some yaml code here.
+		print 'TODO: run some yaml code.'
 